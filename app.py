@@ -20,11 +20,16 @@ st.markdown("""
 **2. 📊 Classement PVT**
 - Classement des 7 Directions Régionales
 - Analyse des ventes PVT
+- Classement sur une période (stock des ventes par date)
 
 **3. 📈 Reporting NFC**
 - Génération de rapports NFC
 - Analyse des données
 
+**4. 🧩 Rapports combinés**
+- Une seule extraction déposée et lue une fois
+- Préactivations et Classement PVT, en une archive ZIP
+
 ---
 
  **Utilisez le menu latéral pour accéder aux outils**
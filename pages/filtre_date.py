@@ -1,9 +1,27 @@
 import streamlit as st
-import pandas as pd
-from openpyxl import load_workbook
-from openpyxl.styles import Font, Alignment, PatternFill, Border, Side
-from io import BytesIO
-from datetime import datetime
+from datetime import date, datetime
+
+from utils.charts import static_pngs, top_pvt_figure
+from utils.classement import (
+    CLASSEMENT_STAGES,
+    DR_MAPPING,
+    clean_sales,
+    count_sales_file,
+    detect_date_column,
+    generate_excel_classement,
+    get_missing_columns,
+    merge_counts,
+    rank_sales,
+)
+from utils.detail_export import AUCUN, choose_detail_format, export_detail
+from utils.export import new_export_sink
+from utils.governor import admit, admit_uploads
+from utils.gsheets import render_publish_panel
+from utils.parallel import file_key, map_files_cached
+from utils.parametres import est_parametrage_par_defaut, parametres_classement
+from utils.pipeline import get_pipeline, render_last_run
+from utils.ranking_history import RankingHistory, filter_signature
+from utils.sales_store import SalesStore, count_daily_sales, default_period, select_stored_sales
 
 # Configuration de la page
 st.set_page_config(page_title="Classement PVT ", layout="wide")
@@ -11,240 +29,270 @@ st.set_page_config(page_title="Classement PVT ", layout="wide")
 # Titre
 st.title("📊 Classement des PVT - 7 Directions Régionales")
 
-# Liste des 7 DR autorisées
-DR_AUTORISEES = [
-    "DV-DRVN_DIRECTION REGIONALE DES VENTES NORD",
-    "DV-DRVC_DIRECTION REGIONALE DES VENTES CENTRE",
-    "DV-DRV1_DIRECTION REGIONALE DES VENTES DAKAR 1",
-    "DV-DRV2_DIRECTION REGIONALE DES VENTES DAKAR 2",
-    "DV-DRVS_DIRECTION REGIONALE DES VENTES SUD",
-    "DV-DRVSE_DIRECTION REGIONALE DES VENTES SUD-EST",
-    "DV-DRVE_DIRECTION REGIONALE DES VENTES EST"
-]
-
-# Mapping pour les codes DR courts
-DR_MAPPING = {
-    "DV-DRVN_DIRECTION REGIONALE DES VENTES NORD": "DRN",
-    "DV-DRVC_DIRECTION REGIONALE DES VENTES CENTRE": "DRC",
-    "DV-DRV1_DIRECTION REGIONALE DES VENTES DAKAR 1": "DR1",
-    "DV-DRV2_DIRECTION REGIONALE DES VENTES DAKAR 2": "DR2",
-    "DV-DRVS_DIRECTION REGIONALE DES VENTES SUD": "DRS",
-    "DV-DRVSE_DIRECTION REGIONALE DES VENTES SUD-EST": "DRSE",
-    "DV-DRVE_DIRECTION REGIONALE DES VENTES EST": "DRE"
-}
-
-# Fonctions
-def filter_pvt(df):
-    df_filtered = df.copy()
-    df_filtered['PVT'] = df_filtered['PVT'].astype(str).str.strip()
-    mask = df_filtered['PVT'].str.upper().str.startswith('PVT')
-    return df_filtered[mask]
-
-def filter_etat_identification(df):
-    df_filtered = df.copy()
-    if 'ETAT_IDENTIFICATION' not in df_filtered.columns:
-        return df_filtered
-    df_filtered['ETAT_IDENTIFICATION'] = df_filtered['ETAT_IDENTIFICATION'].astype(str).str.strip()
-    mask = df_filtered['ETAT_IDENTIFICATION'].str.contains("Identifie Photo", case=False, na=False)
-    return df_filtered[mask]
-
-def get_telephone_by_pvt(df):
-    if 'MSISDN' not in df.columns:
-        return pd.Series([None] * len(df))
-    df['MSISDN_CLEAN'] = df['MSISDN'].astype(str).str.strip()
-    df['MSISDN_CLEAN'] = df['MSISDN_CLEAN'].str.replace(r'\.0$', '', regex=True)
-    telephone_series = df.groupby('PVT')['MSISDN_CLEAN'].first()
-    return df['PVT'].map(telephone_series)
-
-def generate_excel_classement(df_classement):
-    buffer = BytesIO()
-    with pd.ExcelWriter(buffer, engine='openpyxl') as writer:
-        df_classement.to_excel(writer, sheet_name='Classement PVT', index=False)
-
-    buffer.seek(0)
-    wb = load_workbook(buffer)
-    ws = wb.active
-
-    # Styles
-    header_fill = PatternFill(start_color="D9D9D9", end_color="D9D9D9", fill_type="solid")
-    header_font = Font(bold=True, size=11, color="000000")
-    header_alignment = Alignment(horizontal='center', vertical='center')
-
-    data_font = Font(size=10)
-    data_alignment_left = Alignment(horizontal='left', vertical='center')
-    data_alignment_center = Alignment(horizontal='center', vertical='center')
-
-    total_fill = PatternFill(start_color="FFE5CC", end_color="FFE5CC", fill_type="solid")
-    total_font = Font(bold=True, size=11, color="000000")
-
-    thin_border = Border(
-        left=Side(style='thin', color='000000'),
-        right=Side(style='thin', color='000000'),
-        top=Side(style='thin', color='000000'),
-        bottom=Side(style='thin', color='000000')
+def libelle_periode(entry):
+    debut, fin = date.fromisoformat(entry['start']), date.fromisoformat(entry['end'])
+    return f"{debut:%d/%m/%Y}" if debut == fin else f"{debut:%d/%m/%Y} - {fin:%d/%m/%Y}"
+
+def periode_fichiers(periodes):
+    """Période couverte par les ventes des fichiers ; à défaut (pas de date), le jour du dépôt."""
+    periodes = [p for p in periodes if p is not None]
+    if not periodes:
+        return date.today(), date.today()
+    return min(p[0] for p in periodes), max(p[1] for p in periodes)
+
+def afficher_classement(df_grouped, libelle, periode, suffixe_fichier="", charger_detail=None):
+    df_classement = rank_sales(df_grouped)
+
+    # Total
+    total_ventes = df_classement['VENTES_TOTALES'].sum()
+    df_display = df_classement.copy()
+    total_row = ['', 'TOTAL', '', '', '', '', '']
+    if 'ETAT_IDENTIFICATION' in df_classement.columns:
+        total_row.append('')
+    total_row.append(total_ventes)
+    df_display.loc[len(df_display)] = total_row
+
+    # Historique : classements repérés par période de ventes et filtres, comparés à
+    # un classement aux mêmes filtres (par défaut celui de la période précédente)
+    df_evolution = None
+    if st.checkbox("🕘 Enregistrer dans l'historique et comparer à un classement précédent", value=True):
+        historique = RankingHistory()
+        filtres = filter_signature(parametres)
+        debut, fin = periode
+        references = [e for e in historique.snapshots(filtres)
+                      if (e['start'], e['end']) != (debut.isoformat(), fin.isoformat())]
+        precedent = historique.preceding(references, periode)
+        choix = st.selectbox(
+            "Classement de référence (mêmes filtres)",
+            range(len(references) + 1),
+            index=references.index(precedent) + 1 if precedent is not None else 0,
+            format_func=lambda i: "Aucun" if i == 0 else
+            f"{libelle_periode(references[i - 1])} · {references[i - 1]['label']} (enregistré le {references[i - 1]['created']})"
+        )
+        precedent = references[choix - 1] if choix else None
+
+        cle_historique = (libelle, periode, filtres, precedent and precedent['file'], len(df_classement), int(total_ventes))
+        cached = st.session_state.get('classement_historique')
+        if cached is not None and cached[0] == cle_historique:
+            df_evolution = cached[1]
+        else:
+            df_evolution = historique.record_and_compare(df_classement, libelle, periode, filtres, precedent)
+            st.session_state['classement_historique'] = (cle_historique, df_evolution)
+
+        if df_evolution is None:
+            st.info("ℹ️ Classement enregistré sans comparaison : aucun classement de référence avec ces filtres.")
+        else:
+            with st.expander(f"🕘 Évolution depuis « {libelle_periode(precedent)} » ({precedent['label']})", expanded=True):
+                col1, col2, col3 = st.columns(3)
+                col1.metric("Nouveaux vendeurs", int((df_evolution['STATUT'] == 'NOUVEAU').sum()))
+                col2.metric("Vendeurs sortis", int((df_evolution['STATUT'] == 'SORTI').sum()))
+                col3.metric("Évolution des ventes", int(df_evolution['EVOLUTION_VENTES'].sum()))
+                st.dataframe(df_evolution.head(500), use_container_width=True, hide_index=True)
+
+    # Tableau de bord (sur les ventes agrégées par PVT)
+    ventes_pvt = df_classement.groupby('PVT', as_index=False)['VENTES_TOTALES'].sum()
+    with st.expander("📈 Tableau de bord", expanded=True):
+        top_n = st.slider("Nombre de PVT affichés", min_value=5, max_value=50, value=10)
+        fig_top = top_pvt_figure(ventes_pvt, top_n)
+        st.plotly_chart(fig_top, use_container_width=True)
+    integrer_graphiques = st.checkbox("🖼️ Intégrer les graphiques au fichier Excel")
+
+    pngs = None
+    if integrer_graphiques:
+        try:
+            pngs = static_pngs([(fig_top, ventes_pvt, f'top_pvt_{top_n}')])
+        except Exception as e:
+            st.warning(f"⚠️ Graphiques non intégrés : {e}")
+
+    # Génération Excel
+    date_str = datetime.now().strftime("%Y%m%d_%H%M")
+    filename = f"Classement_PVT{suffixe_fichier}{date_str}.xlsx"
+    export = new_export_sink('export_classement', filename)
+    generate_excel_classement(df_classement, export.handle, pngs, df_evolution)
+
+    # Téléchargement
+    export.download_button(
+        label="📥 Télécharger le fichier Excel",
+        use_container_width=True
     )
 
-    # Appliquer les styles
-    for cell in ws[1]:
-        cell.fill = header_fill
-        cell.font = header_font
-        cell.alignment = header_alignment
-        cell.border = thin_border
-
-    max_row = ws.max_row
-    max_col = ws.max_column
-
-    for row in ws.iter_rows(min_row=2, max_row=max_row-1, min_col=1, max_col=max_col):
-        for cell in row:
-            cell.border = thin_border
-            cell.font = data_font
-            if cell.column == 1 or cell.column == 9:
-                cell.alignment = data_alignment_center
-            else:
-                cell.alignment = data_alignment_left
-
-    total_row = max_row
-    for cell in ws[total_row]:
-        cell.fill = total_fill
-        cell.font = total_font
-        cell.border = thin_border
-        if cell.column in [1, 9]:
-            cell.alignment = data_alignment_center
-
-    # Largeurs de colonnes
-    ws.column_dimensions['A'].width = 8
-    ws.column_dimensions['B'].width = 30
-    ws.column_dimensions['C'].width = 15
-    ws.column_dimensions['D'].width = 15
-    ws.column_dimensions['E'].width = 15
-    ws.column_dimensions['F'].width = 10
-    ws.column_dimensions['G'].width = 15
-    ws.column_dimensions['H'].width = 18
-    ws.column_dimensions['I'].width = 12
-
-    ws.freeze_panes = 'A2'
-
-    final_buffer = BytesIO()
-    wb.save(final_buffer)
-    final_buffer.seek(0)
-    return final_buffer
+    # Détail des ventes classées, écrit par blocs (hors limite de lignes d'Excel)
+    if charger_detail is not None:
+        format_detail = choose_detail_format('format_detail_classement', "📄 Export des ventes détaillées (PVT des DR retenues)")
+        if format_detail != AUCUN:
+            with st.spinner("⏳ Écriture du détail..."):
+                df_detail = charger_detail()
+                detail = export_detail(df_detail, format_detail, f"Detail_Ventes_PVT{suffixe_fichier}{date_str}", 'export_detail_classement')
+            detail.download_button(
+                label=f"📥 Télécharger le détail ({len(df_detail)} lignes)",
+                use_container_width=True
+            )
+
+    # Publication Google Sheets (seules les plages modifiées sont envoyées)
+    render_publish_panel({'Classement PVT': df_classement}, 'gsheets_classement')
+    return df_classement
 
 # Interface
-uploaded_file = st.file_uploader("", type=["xlsx", "csv"])
-
-if uploaded_file:
-    try:
-        if uploaded_file.name.endswith('.csv'):
+parametres = parametres_classement()
+libelle_dr = ", ".join(DR_MAPPING.get(dr, dr) for dr in parametres['dr_autorisees'])
+st.caption(f"DR : {libelle_dr or 'aucune'} · État : {parametres['etat'] or 'tous'} · PVT : {', '.join(parametres['prefixes_pvt'])}")
+
+store = SalesStore()
+source = st.radio(
+    "Source des ventes",
+    ["📄 Fichier déposé", "🗓️ Période (stock des ventes)"],
+    horizontal=True
+)
+
+if source == "🗓️ Période (stock des ventes)":
+    jours = store.available_dates()
+    if not jours:
+        st.info("ℹ️ Le stock des ventes est vide : déposez d'abord une extraction contenant une colonne de date.")
+    else:
+        st.caption(f"Stock : {len(jours)} jours, du {jours[0]:%d/%m/%Y} au {jours[-1]:%d/%m/%Y}")
+        periode = st.date_input(
+            "Période de classement",
+            value=default_period(jours),
+            min_value=jours[0],
+            max_value=jours[-1],
+            format="DD/MM/YYYY"
+        )
+        if isinstance(periode, (tuple, list)) and len(periode) == 2:
+            debut, fin = periode
+            par_defaut = est_parametrage_par_defaut(parametres)
+            # Les lignes de la période sont relues si les filtres changent ou pour l'export du détail
+            lit_lignes = not par_defaut or st.session_state.get('format_detail_classement', AUCUN) != AUCUN
+            ticket = admit(store.estimate_memory(debut, fin, rows=lit_lignes), "Classement PVT (période)")
             try:
-                df = pd.read_csv(uploaded_file, sep='|', encoding='utf-8')
-            except:
-                try:
-                    df = pd.read_csv(uploaded_file, sep=';', encoding='utf-8')
-                except:
-                    df = pd.read_csv(uploaded_file, sep=',', encoding='utf-8')
-        else:
-            df = pd.read_excel(uploaded_file)
-
-        # Mapping des colonnes
-        column_mapping = {
-            'ACCUEIL_VENDEUR': 'PVT',
-            'AGENCE_VENDEUR': 'DR',
-            'LOGIN_VENDEUR': 'LOGIN',
-            'MSISDN': 'MSISDN',
-            'ETAT_IDENTIFICATION': 'ETAT_IDENTIFICATION',
-            'PRENOM_VENDEUR': 'PRENOM_VENDEUR',
-            'NOM_VENDEUR': 'NOM_VENDEUR'
-        }
-
-        for old_name, new_name in column_mapping.items():
-            if old_name in df.columns and new_name not in df.columns:
-                df = df.rename(columns={old_name: new_name})
-
-        if 'PRENOM_VENDEUR' not in df.columns:
-            df['PRENOM_VENDEUR'] = ''
-        if 'NOM_VENDEUR' not in df.columns:
-            df['NOM_VENDEUR'] = ''
-
-        required_columns = ['PVT', 'DR', 'LOGIN', 'MSISDN']
-        missing_columns = [col for col in required_columns if col not in df.columns]
-
-        if missing_columns:
-            st.error(f"❌ Colonnes manquantes : {', '.join(missing_columns)}")
-        else:
-            with st.spinner("⏳ Traitement en cours..."):
-                # Filtrage
-                df_filtre_dr = df[df['DR'].isin(DR_AUTORISEES)].copy()
-                if len(df_filtre_dr) == 0:
-                    st.error("❌ Aucune donnée trouvée pour les 7 DR spécifiées.")
-                    st.stop()
-
-                df_filtre_etat = filter_etat_identification(df_filtre_dr)
-                df_filtre_pvt = filter_pvt(df_filtre_etat)
-
-                if len(df_filtre_pvt) == 0:
-                    st.error("❌ Aucun PVT ne commence par 'PVT' dans les données filtrées.")
-                    st.stop()
-
-                # Nettoyage
-                df_filtre_pvt['PVT'] = df_filtre_pvt['PVT'].astype(str).str.strip()
-                df_filtre_pvt['DR'] = df_filtre_pvt['DR'].astype(str).str.strip()
-                df_filtre_pvt['LOGIN'] = df_filtre_pvt['LOGIN'].astype(str).str.strip()
-                df_filtre_pvt['MSISDN'] = df_filtre_pvt['MSISDN'].astype(str).str.strip()
-                df_filtre_pvt['PRENOM_VENDEUR'] = df_filtre_pvt['PRENOM_VENDEUR'].astype(str).str.strip()
-                df_filtre_pvt['NOM_VENDEUR'] = df_filtre_pvt['NOM_VENDEUR'].astype(str).str.strip()
-
-                if 'ETAT_IDENTIFICATION' in df_filtre_pvt.columns:
-                    df_filtre_pvt['ETAT_IDENTIFICATION'] = df_filtre_pvt['ETAT_IDENTIFICATION'].astype(str).str.strip()
-
-                # Téléphone
-                df_filtre_pvt['TELEPHONE'] = get_telephone_by_pvt(df_filtre_pvt)
-
-                # Groupement
-                group_cols = ['DR', 'PVT', 'LOGIN', 'PRENOM_VENDEUR', 'NOM_VENDEUR', 'TELEPHONE']
-                if 'ETAT_IDENTIFICATION' in df_filtre_pvt.columns:
-                    group_cols.append('ETAT_IDENTIFICATION')
-
-                df_grouped = df_filtre_pvt.groupby(group_cols).size().reset_index(name='VENTES_TOTALES')
-
-                # Codes DR courts
-                df_grouped['DR_COURT'] = df_grouped['DR'].map(DR_MAPPING)
-                df_grouped['DR'] = df_grouped['DR_COURT'].fillna(df_grouped['DR'])
-                df_grouped = df_grouped.drop(columns=['DR_COURT'])
-
-                # Tri et classement
-                df_grouped = df_grouped.sort_values('VENTES_TOTALES', ascending=False)
-                df_grouped['RANG'] = range(1, len(df_grouped) + 1)
-
-                # Organisation des colonnes
-                columns_order = ['RANG', 'PVT', 'LOGIN', 'PRENOM_VENDEUR', 'NOM_VENDEUR', 'DR', 'TELEPHONE']
-                if 'ETAT_IDENTIFICATION' in df_grouped.columns:
-                    columns_order.append('ETAT_IDENTIFICATION')
-                columns_order.append('VENTES_TOTALES')
-
-                df_classement = df_grouped[columns_order]
-
-                # Total
-                total_ventes = df_classement['VENTES_TOTALES'].sum()
-                df_display = df_classement.copy()
-                total_row = ['', 'TOTAL', '', '', '', '', '']
-                if 'ETAT_IDENTIFICATION' in df_classement.columns:
-                    total_row.append('')
-                total_row.append(total_ventes)
-                df_display.loc[len(df_display)] = total_row
-
-                # Génération Excel
-                excel_file = generate_excel_classement(df_classement)
-                date_str = datetime.now().strftime("%Y%m%d_%H%M")
-                filename = f"Classement_PVT{date_str}.xlsx"
-
-                # Téléchargement
-                st.download_button(
-                    label="📥 Télécharger le fichier Excel",
-                    data=excel_file,
-                    file_name=filename,
-                    mime="application/vnd.openxmlformats-officedocument.spreadsheetml.sheet",
-                    use_container_width=True
+                with st.spinner("⏳ Lecture des comptages journaliers..."):
+                    if par_defaut:
+                        # Seules les partitions de la période sont lues (comptages pré-calculés)
+                        df_grouped = store.load_counts(debut, fin)
+                    else:
+                        # Filtres modifiés : comptage à partir des lignes de la période
+                        df_grouped = count_daily_sales(store.load_rows(debut, fin), **parametres)
+                if df_grouped.empty:
+                    st.error("❌ Aucune vente dans le stock pour cette période.")
+                else:
+                    afficher_classement(
+                        df_grouped, f"Période {debut:%d/%m/%Y} - {fin:%d/%m/%Y}", (debut, fin), f"_{debut:%Y%m%d}-{fin:%Y%m%d}_",
+                        # Lignes de la période relues seulement si un export du détail est demandé
+                        charger_detail=lambda: clean_sales(select_stored_sales(store.load_rows(debut, fin), **parametres))
+                    )
+
+            except Exception as e:
+                st.error(f"❌ Erreur : {str(e)}")
+            finally:
+                ticket.release()
+else:
+    uploaded_files = st.file_uploader("", type=["xlsx", "csv"], accept_multiple_files=True)
+    uploaded_file = uploaded_files[0] if len(uploaded_files) == 1 else None
+
+    if uploaded_file:
+        ticket = None
+        try:
+            # Lecture et filtres en étapes mémorisées : changer un filtre ne relit pas le fichier
+            pipeline = get_pipeline('pipeline_classement', CLASSEMENT_STAGES)
+            params = dict(parametres, uploaded_file=uploaded_file)
+
+            # File d'attente du gouverneur seulement si la lecture ou les filtres doivent tourner
+            # (les lignes filtrées sont aussi recalculées pour l'export du détail)
+            if (pipeline.pending('schéma', 'période', 'comptage', **params)
+                    or st.session_state.get('format_detail_classement', AUCUN) != AUCUN):
+                ticket = admit_uploads([uploaded_file], "Classement PVT")
+
+            schema = pipeline.run('schéma', **params)
+
+            missing_columns = get_missing_columns(schema)
+
+            if missing_columns:
+                st.error(f"❌ Colonnes manquantes : {', '.join(missing_columns)}")
+            else:
+                with st.spinner("⏳ Traitement en cours..."):
+                    # Stock des ventes par date (si l'extraction a une colonne de date)
+                    date_col = detect_date_column(schema)
+                    if date_col is not None and st.checkbox(
+                        f"🗓️ Ajouter ces ventes au stock (date : {date_col})", value=True
+                    ):
+                        cle_stock = (file_key(uploaded_file), date_col)
+                        if st.session_state.get('stock_ingere') != cle_stock:
+                            # Ré-ingérer un jour remplace sa partition : confirmation demandée
+                            periode_fichier = pipeline.run('période', **params)
+                            deja_stockes = store.stored_days(*periode_fichier) if periode_fichier else []
+                            remplacer = True
+                            if deja_stockes:
+                                st.warning(
+                                    f"⚠️ {len(deja_stockes)} jours couverts par ce fichier sont déjà dans le stock "
+                                    f"({deja_stockes[0]:%d/%m/%Y} → {deja_stockes[-1]:%d/%m/%Y}) : "
+                                    f"leurs ventes seront remplacées par celles du fichier (colonne {date_col})."
+                                )
+                                remplacer = st.checkbox("Remplacer ces jours dans le stock", value=False)
+                            if remplacer:
+                                if ticket is None:
+                                    ticket = admit_uploads([uploaded_file], "Classement PVT")
+                                jours = store.ingest(pipeline.run('lecture', **params), date_col)
+                                st.session_state['stock_ingere'] = cle_stock
+                                if jours:
+                                    st.caption(f"Stock mis à jour : {len(jours)} jours ({jours[0]:%d/%m/%Y} → {jours[-1]:%d/%m/%Y})")
+
+                    # Filtrage, nettoyage, téléphone et groupement (seuls les comptages restent en cache)
+                    comptage = pipeline.run('comptage', **params)
+                    render_last_run(pipeline)
+
+                    if comptage['lignes_dr'] == 0:
+                        st.error(f"❌ Aucune donnée trouvée pour les {len(parametres['dr_autorisees'])} DR spécifiées.")
+                        st.stop()
+
+                    if comptage['comptages'].empty:
+                        st.error(f"❌ Aucun PVT ne commence par '{', '.join(parametres['prefixes_pvt'])}' dans les données filtrées.")
+                        st.stop()
+
+                    afficher_classement(
+                        comptage['comptages'], f"Fichier {uploaded_file.name}",
+                        periode_fichiers([pipeline.run('période', **params)]),
+                        # Lignes filtrées recalculées depuis la lecture seulement si un export du détail est demandé
+                        charger_detail=lambda: pipeline.run('filtre PVT', **params)
+                    )
+
+        except Exception as e:
+            st.error(f"❌ Erreur : {str(e)}")
+        finally:
+            if ticket is not None:
+                ticket.release()
+
+    elif uploaded_files:
+        # Plusieurs fichiers : lecture en parallèle, comptages partiels par fichier puis fusion
+        ticket = admit_uploads(uploaded_files, "Classement PVT")
+        try:
+            noms = [f.name for f in uploaded_files]
+            with st.spinner(f"⏳ Lecture de {len(uploaded_files)} fichiers en parallèle..."):
+                resultats = map_files_cached(
+                    'classement_partiels', count_sales_file, uploaded_files,
+                    parametres['dr_autorisees'], parametres['etat'], parametres['prefixes_pvt']
                 )
 
-    except Exception as e:
-        st.error(f"❌ Erreur : {str(e)}")
\ No newline at end of file
+            manquantes = [r for r in resultats if r['manquantes']]
+            for r in manquantes:
+                st.error(f"❌ {r['fichier']} : colonnes manquantes : {', '.join(r['manquantes'])}")
+            if manquantes:
+                st.stop()
+
+            if sum(r['lignes_dr'] for r in resultats) == 0:
+                st.error(f"❌ Aucune donnée trouvée pour les {len(parametres['dr_autorisees'])} DR spécifiées.")
+                st.stop()
+
+            df_grouped = merge_counts([r['comptages'] for r in resultats])
+            if df_grouped.empty:
+                st.error(f"❌ Aucun PVT ne commence par '{', '.join(parametres['prefixes_pvt'])}' dans les données filtrées.")
+                st.stop()
+
+            # Le stock des ventes et l'export du détail restent réservés au dépôt d'un seul fichier
+            st.caption(f"📚 {len(uploaded_files)} fichiers fusionnés : {', '.join(noms)}")
+            afficher_classement(
+                df_grouped, f"Fichiers {', '.join(noms)}", periode_fichiers([r['periode'] for r in resultats])
+            )
+
+        except Exception as e:
+            st.error(f"❌ Erreur : {str(e)}")
+        finally:
+            ticket.release()
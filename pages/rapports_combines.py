@@ -0,0 +1,84 @@
+import streamlit as st
+from datetime import datetime
+
+from utils.classement import get_missing_columns
+from utils.detail_export import choose_detail_format
+from utils.export import zip_exports
+from utils.governor import admit_uploads
+from utils.parametres import parametres_classement, parametres_preactivation
+from utils.pipeline import get_pipeline, render_last_run
+from utils.rapports_combines import ETAPES_ADMISES, RAPPORTS_COMBINES_STAGES
+
+st.set_page_config(page_title="Rapports combinés", layout="wide")
+
+st.title("🧩 Rapports combinés")
+st.write("Une seule extraction des ventes, lue une fois : Préactivations et Classement PVT")
+
+RAPPORTS = ["🚀 Préactivations", "📊 Classement PVT"]
+
+param_preactivation = parametres_preactivation('combine_preactivation')
+param_classement = parametres_classement('combine_classement')
+
+uploaded_file = st.file_uploader(
+    "Déposez le fichier de ventes global (XLSB, XLSX ou CSV)", type=["xlsb", "xlsx", "csv"]
+)
+rapports = st.multiselect("Rapports à produire", RAPPORTS, default=RAPPORTS)
+format_detail = choose_detail_format('format_detail_combine', "📄 Export des lignes PREACTIVATION (RAVT / ACCUEIL extraits)")
+en_archive = st.checkbox("📦 Télécharger les rapports dans une seule archive ZIP", value=True)
+
+if uploaded_file and rapports:
+    ticket = None
+    try:
+        # Lecture unique partagée par les deux rapports, gardée avec le détail entre deux exécutions
+        pipeline = get_pipeline('pipeline_rapports_combines', RAPPORTS_COMBINES_STAGES)
+        params = dict(param_preactivation, **param_classement, uploaded_file=uploaded_file, format_detail=format_detail)
+
+        # File d'attente du gouverneur seulement si une étape lourde doit tourner
+        if pipeline.pending(*[etape for rapport in rapports for etape in ETAPES_ADMISES[rapport]], **params):
+            ticket = admit_uploads([uploaded_file], "Rapports combinés")
+
+        date_str = datetime.now().strftime("%Y%m%d_%H%M")
+        exports = []
+
+        if "🚀 Préactivations" in rapports:
+            st.subheader("🚀 Préactivations")
+            with st.spinner("⏳ Traitement des données détaillées..."):
+                df_clotures_final, df_rejets_final = pipeline.run('regroupement', ticket=ticket, **params)
+            st.success(f"✅ Analyse terminée : {len(df_clotures_final)} Logins Clôturés / {len(df_rejets_final)} Logins Rejetés")
+
+            detail = pipeline.run('export du détail', **params)
+            if detail is not None:
+                exports.append(detail[0])
+            exports.append(pipeline.run('export', **params)[0])
+
+        if "📊 Classement PVT" in rapports:
+            st.subheader("📊 Classement PVT")
+            missing_columns = get_missing_columns(pipeline.run('schéma', **params))
+
+            if missing_columns:
+                st.error(f"❌ Colonnes manquantes : {', '.join(missing_columns)}")
+            else:
+                with st.spinner("⏳ Comptage des ventes..."):
+                    classement = pipeline.run('classement', **params)
+                if classement is None:
+                    st.error(f"❌ Aucun PVT ne commence par '{', '.join(param_classement['prefixes_pvt'])}' dans les données filtrées.")
+                else:
+                    df_classement, export = classement
+                    st.success(f"✅ Classement terminé : {len(df_classement)} vendeurs classés")
+                    exports.append(export)
+        render_last_run(pipeline)
+
+        # Téléchargement : une archive unique ou un fichier par rapport
+        if exports:
+            if en_archive:
+                archive = zip_exports('export_combine_zip', f"Rapports_{date_str}.zip", exports)
+                archive.download_button(label="📥 Télécharger l'archive des rapports", use_container_width=True)
+            else:
+                for export in exports:
+                    export.download_button(label=f"📥 Télécharger {export.file_name}", key=export.file_name)
+
+    except Exception as e:
+        st.error(f"❌ Erreur : {str(e)}")
+    finally:
+        if ticket is not None:
+            ticket.release()
@@ -1,73 +1,84 @@
 import streamlit as st
 import pandas as pd
-import io
+
+from utils.charts import insert_pngs_xlsxwriter, nfc_rate_by_dr_figure, nfc_rate_by_sadi_figure, static_pngs
+from utils.detail_export import AUCUN, RollingSheet, choose_detail_format, export_detail
+from utils.export import new_export_sink
+from utils.governor import admit_uploads, session_cache
+from utils.gsheets import render_publish_panel
+from utils.nfc import (
+    get_explorer,
+    merge_nfc_parts,
+    prepare_nfc_file,
+    read_reference,
+    render_explorer,
+)
+from utils.parallel import file_key, map_files_cached
 
 st.set_page_config(page_title="Orange NFC - Reporting Officiel", layout="wide")
 
 st.title("📊 Reporting NFC : Synthèse & Détail DR-SADI-RAVT")
 
-# Mapping officiel des DR
-DR_MAPPING = {
-    'DV-DRVE_DIRECTION REGIONALE DES VENTES EST': 'DRE',
-    'DV-DRVC_DIRECTION REGIONALE DES VENTES CENTRE': 'DRC',
-    'DV-DRVN_DIRECTION REGIONALE DES VENTES NORD': 'DRN',
-    'DV-DRVSE_DIRECTION REGIONALE DES VENTES SUD-EST': 'DRSE',
-    'DV-DRV2_DIRECTION REGIONALE DES VENTES DAKAR 2': 'DR2',
-    'DV-DRV1_DIRECTION REGIONALE DES VENTES DAKAR 1': 'DR1',
-    'DV-DRVS_DIRECTION REGIONALE DES VENTES SUD': 'DRS'
-}
-
 col1, col2 = st.columns(2)
 with col1:
     ref_file = st.file_uploader("1. Déposez le RÉFÉRENTIEL (Mapping)", type=["csv", "xlsx"])
 with col2:
-    weekly_file = st.file_uploader("2. Déposez le fichier WEEKLY STAT NFC", type=["csv", "xlsx", "xlsb"])
+    weekly_files = st.file_uploader(
+        "2. Déposez le ou les fichiers WEEKLY STAT NFC (un par DR possible)",
+        type=["csv", "xlsx", "xlsb"], accept_multiple_files=True
+    )
 
-if ref_file and weekly_file:
+if ref_file and weekly_files:
+    ticket = None
     try:
-        # --- 1. LECTURE ET NETTOYAGE DU RÉFÉRENTIEL ---
-        df_ref = pd.read_csv(ref_file) if ref_file.name.endswith('.csv') else pd.read_excel(ref_file)
-        df_ref.columns = [str(c).strip() for c in df_ref.columns]
-        # On garde une seule ligne par LOGIN pour ne pas multiplier les stats
-        df_ref = df_ref[['LOGIN', 'SADI', 'RAVT']].drop_duplicates(subset=['LOGIN'])
-
-        # --- 2. LECTURE DU WEEKLY ---
-        if weekly_file.name.endswith('.csv'):
-            df_weekly = pd.read_csv(weekly_file, sep=';')
-        elif weekly_file.name.endswith('.xlsb'):
-            df_weekly = pd.read_excel(weekly_file, engine='pyxlsb')
-        else:
-            df_weekly = pd.read_excel(weekly_file)
-
-        df_weekly.columns = [str(c).strip() for c in df_weekly.columns]
-
-        # --- 3. TRAITEMENT ---
-        # Filtrage et renommage des DR initial
-        df_weekly = df_weekly[df_weekly['AGENCE'].isin(DR_MAPPING.keys())].copy()
-        df_weekly['DR'] = df_weekly['AGENCE'].map(DR_MAPPING)
-
-        # Jointure INNER pour ne garder que ce qui est mappé (Supprime les "Inconnus")
-        df_final = pd.merge(df_weekly, df_ref, on='LOGIN', how='inner')
-
-        # Nettoyage strict des lignes vides ou sans SADI/RAVT
-        df_final = df_final.dropna(subset=['SADI', 'RAVT'])
-        df_final = df_final[(df_final['SADI'].astype(str).str.strip() != "") &
-                            (df_final['RAVT'].astype(str).str.strip() != "")]
-
-        # CORRECTION : Garder seulement le SADI qui correspond au DR du LOGIN
-        # Cela évite qu'un SADI apparaisse dans plusieurs DR
-        df_final = df_final.drop_duplicates(subset=['LOGIN', 'SADI', 'RAVT', 'DR'])
-
-        # Nettoyer les valeurs numériques nulles ou invalides
-        df_final = df_final[
-            (df_final['OPERATION NFC'].notna()) &
-            (df_final['OPERATION MANUELLE'].notna()) &
-            (df_final['TOTAL OPERATION'].notna())
+        # --- 1. LECTURE ET NETTOYAGE (une seule fois par jeu de fichiers) ---
+        data_key = (file_key(ref_file), tuple(file_key(f) for f in weekly_files))
+        cache = session_cache('nfc_data')
+        df_final = cache.get(data_key)
+        if df_final is None:
+            # File d'attente du gouverneur seulement pour la lecture des fichiers
+            ticket = admit_uploads([ref_file, *weekly_files], "Reporting NFC")
+            # Chaque fichier est lu et rattaché au référentiel (dans le pool s'il y en a plusieurs) ;
+            # les fichiers déjà préparés avec ce référentiel ne sont pas relus
+            df_ref = read_reference(ref_file)
+            with st.spinner(f"⏳ Lecture de {len(weekly_files)} fichier(s) WEEKLY..."):
+                df_final = merge_nfc_parts(map_files_cached(
+                    'nfc_parties', prepare_nfc_file, weekly_files, df_ref, args_key=file_key(ref_file)
+                ))
+            del df_ref
+            cache.put({data_key: df_final})
+
+        mode = st.radio(
+            "Mode",
+            ["📥 Reporting Excel", "🔎 Explorateur DR → SADI → RAVT → PVT → VTO", "📈 Tableau de bord"],
+            horizontal=True
+        )
+        explorer = get_explorer('nfc_explorer', data_key, df_final)
+
+        # --- 2. EXPLORATEUR : calcul des niveaux à la demande, sans générer le classeur ---
+        if mode == "🔎 Explorateur DR → SADI → RAVT → PVT → VTO":
+            render_explorer(explorer)
+            st.stop()
+
+        # Graphiques tracés sur les agrégats DR et DR/SADI, jamais sur les lignes brutes
+        synthese_dr = explorer.aggregate(['DR'])
+        synthese_sadi = explorer.aggregate(['DR', 'SADI'])
+        charts = [
+            (nfc_rate_by_dr_figure(synthese_dr), synthese_dr, 'nfc_dr'),
+            (nfc_rate_by_sadi_figure(synthese_sadi), synthese_sadi, 'nfc_sadi'),
         ]
 
-        # --- 4. GÉNÉRATION EXCEL ---
-        output = io.BytesIO()
-        with pd.ExcelWriter(output, engine='xlsxwriter') as writer:
+        if mode == "📈 Tableau de bord":
+            for fig, _, _ in charts:
+                st.plotly_chart(fig, use_container_width=True)
+            st.stop()
+
+        integrer_graphiques = st.checkbox("🖼️ Intégrer les graphiques au classeur")
+        format_detail = choose_detail_format('format_detail_nfc', "📄 Export des lignes WEEKLY enrichies (DR, SADI, RAVT)")
+
+        # --- 3. GÉNÉRATION EXCEL ---
+        export = new_export_sink('export_nfc', "Reporting_NFC_Orange_Final.xlsx")
+        with pd.ExcelWriter(export.handle, engine='xlsxwriter') as writer:
             workbook = writer.book
 
             # FORMATS
@@ -225,27 +236,35 @@ if ref_file and weekly_file:
             ws3.set_column('E:E', 15)
 
             # --- FEUILLE 4 : REPORTING DR-RAVT-PVT-VTO ---
-            ws4 = workbook.add_worksheet('REPORTING DR-RAVT-PVT-VTO')
+            # Une ligne par VTO : la feuille continue sur « (2) », « (3) »... au-delà de la limite d'Excel
             headers_vto = ['DR/RAVT/PVT/VTO', 'Prénom', 'Nom', 'LOGIN', 'OP NFC', 'OP MANUELLE', 'TOTAL', 'Taux']
-            for c, h in enumerate(headers_vto): ws4.write(0, c, h, h_fmt)
+
+            def preparer_feuille_vto(ws):
+                for c, h in enumerate(headers_vto): ws.write(0, c, h, h_fmt)
+                ws.set_column('A:A', 35)
+                ws.set_column('B:C', 20)
+                ws.set_column('D:D', 25)
+                ws.set_column('E:G', 15)
+                ws.set_column('H:H', 15)
+
+            feuille_vto = RollingSheet(workbook, 'REPORTING DR-RAVT-PVT-VTO', preparer_feuille_vto)
 
             vto_fmt = workbook.add_format({'border': 1, 'indent': 3, 'font_size': 9})
             vto_num_fmt = workbook.add_format({'border': 1, 'align': 'center', 'font_size': 9})
             vto_taux_fmt = workbook.add_format({'border': 1, 'num_format': '0"%"', 'align': 'center', 'font_size': 9})
 
-            curr_row = 1
             for dr, dr_group in df_pvt.groupby('DR', sort=True):
                 if len(dr_group) == 0 or dr_group['TOTAL OPERATION'].sum() == 0:
                     continue
 
                 # Ligne DR
                 n_dr, m_dr, t_dr = dr_group['OPERATION NFC'].sum(), dr_group['OPERATION MANUELLE'].sum(), dr_group['TOTAL OPERATION'].sum()
+                ws4, curr_row = feuille_vto.next_row()
                 ws4.write(curr_row, 0, dr, dr_fmt)
                 ws4.write(curr_row, 4, n_dr, dr_fmt)
                 ws4.write(curr_row, 5, m_dr, dr_fmt)
                 ws4.write(curr_row, 6, t_dr, dr_fmt)
                 ws4.write(curr_row, 7, (n_dr/t_dr*100) if t_dr > 0 else 0, dr_taux_fmt)
-                curr_row += 1
 
                 for ravt, ravt_group in dr_group.groupby('RAVT', sort=True):
                     if len(ravt_group) == 0 or ravt_group['TOTAL OPERATION'].sum() == 0:
@@ -253,12 +272,12 @@ if ref_file and weekly_file:
 
                     # Ligne RAVT
                     n_r, m_r, t_r = ravt_group['OPERATION NFC'].sum(), ravt_group['OPERATION MANUELLE'].sum(), ravt_group['TOTAL OPERATION'].sum()
+                    ws4, curr_row = feuille_vto.next_row()
                     ws4.write(curr_row, 0, ravt, sadi_fmt)
                     ws4.write(curr_row, 4, n_r, sadi_fmt)
                     ws4.write(curr_row, 5, m_r, sadi_fmt)
                     ws4.write(curr_row, 6, t_r, sadi_fmt)
                     ws4.write(curr_row, 7, (n_r/t_r*100) if t_r > 0 else 0, sadi_taux_fmt)
-                    curr_row += 1
 
                     for pvt, pvt_group in ravt_group.groupby('ACCUEIL', sort=True):
                         if len(pvt_group) == 0 or pvt_group['TOTAL OPERATION'].sum() == 0:
@@ -266,22 +285,21 @@ if ref_file and weekly_file:
 
                         # Ligne PVT
                         n_p, m_p, t_p = pvt_group['OPERATION NFC'].sum(), pvt_group['OPERATION MANUELLE'].sum(), pvt_group['TOTAL OPERATION'].sum()
+                        ws4, curr_row = feuille_vto.next_row()
                         ws4.write(curr_row, 0, pvt, ravt_fmt)
                         ws4.write(curr_row, 4, n_p, ravt_fmt)
                         ws4.write(curr_row, 5, m_p, ravt_fmt)
                         ws4.write(curr_row, 6, t_p, ravt_fmt)
                         ws4.write(curr_row, 7, (n_p/t_p*100) if t_p > 0 else 0, ravt_taux_fmt)
-                        curr_row += 1
 
-                        # Lignes VTO (détail par LOGIN)
-                        for _, vto_row in pvt_group.iterrows():
-                            prenom = vto_row.get('PRENOM', '')
-                            nom = vto_row.get('NOM', '')
-                            login = vto_row.get('LOGIN', '')
-                            n_v = vto_row['OPERATION NFC']
-                            m_v = vto_row['OPERATION MANUELLE']
-                            t_v = vto_row['TOTAL OPERATION']
+                        # Lignes VTO (détail par LOGIN) : noms lus dans la dimension vendeurs
+                        for login, n_v, m_v, t_v in zip(
+                            pvt_group['LOGIN'], pvt_group['OPERATION NFC'],
+                            pvt_group['OPERATION MANUELLE'], pvt_group['TOTAL OPERATION']
+                        ):
+                            prenom, nom = explorer.vendeurs.get(login, ('', ''))
 
+                            ws4, curr_row = feuille_vto.next_row()
                             ws4.write(curr_row, 0, 'VTO', vto_fmt)
                             ws4.write(curr_row, 1, prenom, vto_fmt)
                             ws4.write(curr_row, 2, nom, vto_fmt)
@@ -290,16 +308,31 @@ if ref_file and weekly_file:
                             ws4.write(curr_row, 5, m_v, vto_num_fmt)
                             ws4.write(curr_row, 6, t_v, vto_num_fmt)
                             ws4.write(curr_row, 7, (n_v/t_v*100) if t_v > 0 else 0, vto_taux_fmt)
-                            curr_row += 1
 
-            ws4.set_column('A:A', 35)
-            ws4.set_column('B:C', 20)
-            ws4.set_column('D:D', 25)
-            ws4.set_column('E:G', 15)
-            ws4.set_column('H:H', 15)
+            # --- FEUILLE 5 : GRAPHIQUES (optionnelle, rendus PNG en cache) ---
+            if integrer_graphiques:
+                try:
+                    insert_pngs_xlsxwriter(workbook, 'GRAPHIQUES', static_pngs(charts))
+                except Exception as e:
+                    st.warning(f"⚠️ Graphiques non intégrés : {e}")
 
         st.success("✅ Fichier corrigé généré avec succès !")
-        st.download_button("📥 Télécharger le Reporting Final", output.getvalue(), "Reporting_NFC_Orange_Final.xlsx")
+        export.download_button("📥 Télécharger le Reporting Final")
+
+        # Détail des lignes enrichies, écrit par blocs (hors limite de lignes d'Excel)
+        if format_detail != AUCUN:
+            with st.spinner("⏳ Écriture du détail..."):
+                detail = export_detail(df_final, format_detail, "Detail_NFC_Weekly", 'export_detail_nfc')
+            detail.download_button(f"📥 Télécharger le détail ({len(df_final)} lignes)")
+
+        # Publication Google Sheets : synthèse DR et détail agrégé par LOGIN
+        render_publish_panel({
+            'SYNTHESE DR': synthese_dr,
+            'DETAIL DR-SADI-RAVT-PVT-VTO': explorer.aggregate(['DR', 'SADI', 'RAVT', 'ACCUEIL', 'LOGIN']),
+        }, 'gsheets_nfc')
 
     except Exception as e:
-        st.error(f"Erreur : {e}")
\ No newline at end of file
+        st.error(f"Erreur : {e}")
+    finally:
+        if ticket is not None:
+            ticket.release()
\ No newline at end of file
@@ -0,0 +1,78 @@
+"""Publication Google Sheets sur le backend simulé (pas d'accès réseau)."""
+import pandas as pd
+
+from utils.gsheets import CHUNK_ROWS, FakeSheetsBackend, SheetsPublisher, frame_to_grid
+
+KEY = "classeur-test"
+
+
+def make_frame(nb_rows, nb_cols=3):
+    return pd.DataFrame({f"C{c}": [f"{r}-{c}" for r in range(nb_rows)] for c in range(nb_cols)})
+
+
+def make_publisher(backend, sleeps=None):
+    sleep = sleeps.append if sleeps is not None else (lambda seconds: None)
+    return SheetsPublisher(backend, KEY, sleep=sleep)
+
+
+def updated_ranges(backend):
+    return [r for call in backend.calls if call[0] == "batch_update" for r in call[2]]
+
+
+def test_republish_sends_only_changed_blocks():
+    backend = FakeSheetsBackend()
+    publisher = make_publisher(backend)
+    df = make_frame(3 * CHUNK_ROWS)
+    publisher.publish({"Feuille": df})
+
+    backend.calls.clear()
+    df.loc[CHUNK_ROWS + 10, "C1"] = "modifié"
+    stats = publisher.publish({"Feuille": df})
+
+    # Seul le deuxième bloc (lignes 501 à 1000 de la feuille) est renvoyé
+    assert updated_ranges(backend) == [f"'Feuille'!A{CHUNK_ROWS + 1}:C{2 * CHUNK_ROWS}"]
+    assert stats["unchanged_blocks"] == 3
+    assert backend.read(KEY, "Feuille") == frame_to_grid(df)
+
+
+def test_republish_identical_frame_sends_nothing():
+    backend = FakeSheetsBackend()
+    publisher = make_publisher(backend)
+    df = make_frame(10)
+    publisher.publish({"Feuille": df})
+
+    backend.calls.clear()
+    stats = publisher.publish({"Feuille": df})
+
+    assert backend.calls == []
+    assert stats["requests"] == 0
+
+
+def test_shrinking_frame_clears_leftover_cells():
+    backend = FakeSheetsBackend()
+    publisher = make_publisher(backend)
+    publisher.publish({"Feuille": make_frame(2 * CHUNK_ROWS, nb_cols=4)})
+
+    backend.calls.clear()
+    petit = make_frame(20, nb_cols=2)
+    publisher.publish({"Feuille": petit})
+
+    clears = [call for call in backend.calls if call[0] == "batch_clear"]
+    assert len(clears) == 1
+    # Lignes en trop (toutes colonnes) et colonnes en trop (lignes restantes)
+    assert clears[0][2] == ["'Feuille'!A22:D1001", "'Feuille'!C1:D21"]
+    assert backend.read(KEY, "Feuille") == frame_to_grid(petit)
+
+
+def test_quota_errors_are_retried_with_backoff():
+    backend = FakeSheetsBackend(fail_times=2)
+    sleeps = []
+    publisher = make_publisher(backend, sleeps)
+    df = make_frame(10)
+
+    publisher.publish({"Feuille": df})
+
+    # Deux échecs simulés sur la création de la feuille, puis succès
+    assert [call[0] for call in backend.calls][:3] == ["ensure_worksheet"] * 3
+    assert len([s for s in sleeps if s >= 2]) >= 2
+    assert backend.read(KEY, "Feuille") == frame_to_grid(df)
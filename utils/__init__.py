@@ -0,0 +1 @@
+"""Modules partagés entre les pages de l'application Streamlit."""
@@ -0,0 +1,146 @@
+"""Graphiques du tableau de bord, tracés uniquement sur des séries pré-agrégées.
+
+Les rendus PNG statiques (kaleido) sont mis en cache par empreinte des
+données, en mémoire et sur disque, pour être réutilisés dans les classeurs.
+Les deux caches sont bornés : les rendus les moins récemment utilisés sont
+retirés en premier.
+"""
+import hashlib
+import os
+import tempfile
+import threading
+from collections import OrderedDict
+from io import BytesIO
+
+import pandas as pd
+import plotly.express as px
+from openpyxl.drawing.image import Image
+
+CACHE_DIR = os.path.join(
+    os.environ.get("PREACTIVATION_CACHE_DIR", os.path.join(tempfile.gettempdir(), "preactivation_cache")),
+    "charts"
+)
+
+# Rendus gardés en mémoire (nombre) et sur disque (en Mo)
+PNG_CACHE_ENTREES = int(os.environ.get("PREACTIVATION_PNG_CACHE_ENTRIES", "64"))
+PNG_CACHE_DISQUE_MO = int(os.environ.get("PREACTIVATION_PNG_CACHE_DISK_MB", "100"))
+
+ORANGE = "#FF6600"
+COULEURS_SPLIT = {"Clôtures": "#4472C4", "Rejets": ORANGE}
+
+_PNG_CACHE = OrderedDict()
+_PNG_LOCK = threading.Lock()
+
+
+def data_hash(df, *extra):
+    """Empreinte stable d'une série agrégée (et des paramètres du graphique)."""
+    h = hashlib.sha1()
+    h.update(pd.util.hash_pandas_object(df, index=False).values.tobytes())
+    h.update("|".join(map(str, list(df.columns) + list(extra))).encode("utf-8"))
+    return h.hexdigest()
+
+
+def nfc_rate_by_dr_figure(synthese_dr):
+    fig = px.bar(synthese_dr, x="DR", y="Taux", text_auto=".0f", title="Taux NFC par DR (%)",
+                 color_discrete_sequence=[ORANGE])
+    fig.update_layout(yaxis_range=[0, 100])
+    return fig
+
+
+def nfc_rate_by_sadi_figure(synthese_sadi):
+    fig = px.bar(synthese_sadi, x="SADI", y="Taux", color="DR", title="Taux NFC par SADI (%)")
+    fig.update_layout(yaxis_range=[0, 100], xaxis={"categoryorder": "total descending"})
+    return fig
+
+
+def top_pvt_figure(ventes_pvt, n):
+    top = ventes_pvt.nlargest(n, "VENTES_TOTALES").sort_values("VENTES_TOTALES")
+    fig = px.bar(top, x="VENTES_TOTALES", y="PVT", orientation="h", text_auto=True,
+                 title=f"Top {n} PVT par ventes", color_discrete_sequence=[ORANGE])
+    fig.update_layout(height=max(400, 22 * len(top)))
+    return fig
+
+
+def split_by_dr(df_clotures, df_rejets):
+    """Préactivations clôturées / rejetées par DR, depuis les tableaux agrégés par LOGIN."""
+    parts = {}
+    for nom, df in (("Clôtures", df_clotures), ("Rejets", df_rejets)):
+        parts[nom] = df.groupby("DR")["PREACTIVATIONS"].sum() if not df.empty else pd.Series(dtype="int64")
+    split = pd.DataFrame(parts).fillna(0)
+    split.index.name = "DR"
+    return split.reset_index()
+
+
+def split_figure(split_dr):
+    """Répartition clôtures / rejets par DR (colonnes DR, Clôtures, Rejets)."""
+    long = split_dr.melt(id_vars="DR", value_vars=["Clôtures", "Rejets"],
+                         var_name="Type", value_name="PREACTIVATIONS")
+    return px.bar(long, x="DR", y="PREACTIVATIONS", color="Type", barmode="stack",
+                  title="Préactivations : clôtures vs rejets", color_discrete_map=COULEURS_SPLIT)
+
+
+def _prune_disk_cache(max_bytes):
+    """Supprime les PNG les plus anciennement utilisés au-delà de `max_bytes` sur disque."""
+    entries = []
+    for name in os.listdir(CACHE_DIR):
+        try:
+            info = os.stat(os.path.join(CACHE_DIR, name))
+        except FileNotFoundError:
+            continue
+        entries.append((info.st_mtime, info.st_size, name))
+    total = sum(size for _, size, _ in entries)
+    for _, size, name in sorted(entries):
+        if total <= max_bytes:
+            break
+        try:
+            os.remove(os.path.join(CACHE_DIR, name))
+        except FileNotFoundError:
+            pass
+        total -= size
+
+
+def render_png(fig, key, width=900, height=500):
+    """Rendu PNG kaleido du graphique, mis en cache sous la clé `key` (empreinte des données)."""
+    with _PNG_LOCK:
+        if key in _PNG_CACHE:
+            _PNG_CACHE.move_to_end(key)
+            return _PNG_CACHE[key]
+    path = os.path.join(CACHE_DIR, f"{key}.png")
+    if os.path.exists(path):
+        with open(path, "rb") as f:
+            png = f.read()
+        # Date de modification = dernière utilisation (ordre de nettoyage du disque)
+        os.utime(path)
+    else:
+        png = fig.to_image(format="png", width=width, height=height)
+        os.makedirs(CACHE_DIR, exist_ok=True)
+        with open(path, "wb") as f:
+            f.write(png)
+        _prune_disk_cache(PNG_CACHE_DISQUE_MO * 1024 * 1024)
+    with _PNG_LOCK:
+        _PNG_CACHE[key] = png
+        _PNG_CACHE.move_to_end(key)
+        while len(_PNG_CACHE) > PNG_CACHE_ENTREES:
+            _PNG_CACHE.popitem(last=False)
+    return png
+
+
+def static_pngs(charts):
+    """PNG des graphiques `(figure, données agrégées, nom)`, via le cache."""
+    return [render_png(fig, data_hash(data, name)) for fig, data, name in charts]
+
+
+def insert_pngs_xlsxwriter(workbook, sheet_name, pngs):
+    """Ajoute une feuille de graphiques à un classeur xlsxwriter."""
+    ws = workbook.add_worksheet(sheet_name)
+    for i, png in enumerate(pngs):
+        ws.insert_image(i * 27, 0, f"graphique_{i + 1}.png", {"image_data": BytesIO(png)})
+    return ws
+
+
+def insert_pngs_openpyxl(workbook, sheet_name, pngs):
+    """Ajoute une feuille de graphiques à un classeur openpyxl."""
+    ws = workbook.create_sheet(sheet_name)
+    for i, png in enumerate(pngs):
+        ws.add_image(Image(BytesIO(png)), f"A{i * 27 + 1}")
+    return ws
@@ -0,0 +1,338 @@
+"""Classement des PVT : lecture, filtrage, comptage des ventes et classeur Excel."""
+import pandas as pd
+from openpyxl.styles import Font, Alignment, PatternFill, Border, Side
+
+from utils.charts import insert_pngs_openpyxl
+from utils.parallel import as_file
+from utils.pipeline import Stage
+from utils.vendeurs import VENDOR_KEY, vendor_ids, vendor_table
+
+# Liste des 7 DR autorisées
+DR_AUTORISEES = [
+    "DV-DRVN_DIRECTION REGIONALE DES VENTES NORD",
+    "DV-DRVC_DIRECTION REGIONALE DES VENTES CENTRE",
+    "DV-DRV1_DIRECTION REGIONALE DES VENTES DAKAR 1",
+    "DV-DRV2_DIRECTION REGIONALE DES VENTES DAKAR 2",
+    "DV-DRVS_DIRECTION REGIONALE DES VENTES SUD",
+    "DV-DRVSE_DIRECTION REGIONALE DES VENTES SUD-EST",
+    "DV-DRVE_DIRECTION REGIONALE DES VENTES EST"
+]
+
+# Mapping pour les codes DR courts
+DR_MAPPING = {
+    "DV-DRVN_DIRECTION REGIONALE DES VENTES NORD": "DRN",
+    "DV-DRVC_DIRECTION REGIONALE DES VENTES CENTRE": "DRC",
+    "DV-DRV1_DIRECTION REGIONALE DES VENTES DAKAR 1": "DR1",
+    "DV-DRV2_DIRECTION REGIONALE DES VENTES DAKAR 2": "DR2",
+    "DV-DRVS_DIRECTION REGIONALE DES VENTES SUD": "DRS",
+    "DV-DRVSE_DIRECTION REGIONALE DES VENTES SUD-EST": "DRSE",
+    "DV-DRVE_DIRECTION REGIONALE DES VENTES EST": "DRE"
+}
+
+# Mapping des colonnes de l'extraction nationale
+COLUMN_MAPPING = {
+    'ACCUEIL_VENDEUR': 'PVT',
+    'AGENCE_VENDEUR': 'DR',
+    'LOGIN_VENDEUR': 'LOGIN',
+    'MSISDN': 'MSISDN',
+    'ETAT_IDENTIFICATION': 'ETAT_IDENTIFICATION',
+    'PRENOM_VENDEUR': 'PRENOM_VENDEUR',
+    'NOM_VENDEUR': 'NOM_VENDEUR'
+}
+
+REQUIRED_COLUMNS = ['PVT', 'DR', 'LOGIN', 'MSISDN']
+
+# Identité d'un vendeur dans le classement (le téléphone dépend du PVT)
+VENDOR_COLS = ['DR', 'PVT', 'LOGIN', 'PRENOM_VENDEUR', 'NOM_VENDEUR']
+
+# Filtres par défaut (modifiables depuis les pages)
+ETAT_IDENTIFICATION_RETENU = "Identifie Photo"
+PREFIXES_PVT = ('PVT',)
+
+# Colonnes de date reconnues dans l'extraction, par ordre de préférence
+DATE_CANDIDATES = ['DATE_VENTE', 'DATE_ACTIVATION', 'DATE_IDENTIFICATION', 'DATE']
+
+def filter_pvt(df, prefixes_pvt=PREFIXES_PVT):
+    df_filtered = df.copy()
+    df_filtered['PVT'] = df_filtered['PVT'].astype(str).str.strip()
+    mask = df_filtered['PVT'].str.upper().str.startswith(tuple(p.upper() for p in prefixes_pvt))
+    return df_filtered[mask]
+
+def filter_etat_identification(df, etat=ETAT_IDENTIFICATION_RETENU):
+    df_filtered = df.copy()
+    if 'ETAT_IDENTIFICATION' not in df_filtered.columns:
+        return df_filtered
+    df_filtered['ETAT_IDENTIFICATION'] = df_filtered['ETAT_IDENTIFICATION'].astype(str).str.strip()
+    mask = df_filtered['ETAT_IDENTIFICATION'].str.contains(etat, case=False, na=False, regex=False)
+    return df_filtered[mask]
+
+def get_telephone_by_pvt(df):
+    """Téléphone de chaque PVT : son premier MSISDN non vide (série indexée par PVT, `df` n'est pas modifié)."""
+    if 'MSISDN' not in df.columns:
+        return pd.Series(dtype=object)
+    telephone = df.groupby('PVT', sort=False)['MSISDN'].first()
+    return telephone.where(telephone.isna(), telephone.astype(str).str.strip().str.replace(r'\.0$', '', regex=True))
+
+def detect_date_column(df):
+    """Colonne de date de vente : seulement les noms connus (pas DATE_NAISSANCE, DATE_EXPIRATION...)."""
+    for col in DATE_CANDIDATES:
+        if col in df.columns:
+            return col
+    return None
+
+def parse_sale_dates(column):
+    """Jours de vente d'une colonne de date (NaT si illisible)."""
+    if pd.api.types.is_numeric_dtype(column):
+        # Dates Excel sérialisées (fichiers xlsb)
+        dates = pd.to_datetime(column, unit='D', origin='1899-12-30', errors='coerce')
+    else:
+        dates = pd.to_datetime(column, errors='coerce', dayfirst=True)
+    return dates.dt.normalize()
+
+def sales_period(df):
+    """(premier jour, dernier jour) des ventes de l'extraction, ou None sans date exploitable."""
+    date_col = detect_date_column(df)
+    if date_col is None:
+        return None
+    dates = parse_sale_dates(df[date_col]).dropna()
+    if dates.empty:
+        return None
+    return dates.min().date(), dates.max().date()
+
+def read_sales_file(uploaded_file):
+    if uploaded_file.name.endswith('.csv'):
+        try:
+            return pd.read_csv(uploaded_file, sep='|', encoding='utf-8')
+        except:
+            try:
+                uploaded_file.seek(0)
+                return pd.read_csv(uploaded_file, sep=';', encoding='utf-8')
+            except:
+                uploaded_file.seek(0)
+                return pd.read_csv(uploaded_file, sep=',', encoding='utf-8')
+    return pd.read_excel(uploaded_file)
+
+def normalize_sales_columns(df):
+    for old_name, new_name in COLUMN_MAPPING.items():
+        if old_name in df.columns and new_name not in df.columns:
+            df = df.rename(columns={old_name: new_name})
+
+    if 'PRENOM_VENDEUR' not in df.columns:
+        df['PRENOM_VENDEUR'] = ''
+    if 'NOM_VENDEUR' not in df.columns:
+        df['NOM_VENDEUR'] = ''
+    return df
+
+def get_missing_columns(df):
+    return [col for col in REQUIRED_COLUMNS if col not in df.columns]
+
+def extract_sales_columns(df):
+    """Colonnes du classement (renommées) prises dans une extraction déjà lue, sans la modifier."""
+    return normalize_sales_columns(df[[c for c in COLUMN_MAPPING if c in df.columns]].copy())
+
+def filter_dr(df, dr_autorisees=DR_AUTORISEES):
+    return df[df['DR'].isin(dr_autorisees)].copy()
+
+def clean_sales(df_filtre_pvt):
+    df_filtre_pvt['PVT'] = df_filtre_pvt['PVT'].astype(str).str.strip()
+    df_filtre_pvt['DR'] = df_filtre_pvt['DR'].astype(str).str.strip()
+    df_filtre_pvt['LOGIN'] = df_filtre_pvt['LOGIN'].astype(str).str.strip()
+    df_filtre_pvt['MSISDN'] = df_filtre_pvt['MSISDN'].astype(str).str.strip()
+    df_filtre_pvt['PRENOM_VENDEUR'] = df_filtre_pvt['PRENOM_VENDEUR'].astype(str).str.strip()
+    df_filtre_pvt['NOM_VENDEUR'] = df_filtre_pvt['NOM_VENDEUR'].astype(str).str.strip()
+
+    if 'ETAT_IDENTIFICATION' in df_filtre_pvt.columns:
+        df_filtre_pvt['ETAT_IDENTIFICATION'] = df_filtre_pvt['ETAT_IDENTIFICATION'].astype(str).str.strip()
+
+    # Le téléphone est un attribut du vendeur : il est joint aux comptages (count_sales)
+    return df_filtre_pvt
+
+def get_group_cols(df):
+    group_cols = ['DR', 'PVT', 'LOGIN', 'PRENOM_VENDEUR', 'NOM_VENDEUR', 'TELEPHONE']
+    if 'ETAT_IDENTIFICATION' in df.columns:
+        group_cols.append('ETAT_IDENTIFICATION')
+    return group_cols
+
+def count_sales(df_filtre_pvt):
+    """Ventes par vendeur (et état d'identification), comptées sur la clé entière du vendeur."""
+    ids, nb_vendeurs = vendor_ids(df_filtre_pvt, VENDOR_COLS)
+    vendeurs = vendor_table({c: df_filtre_pvt[c] for c in VENDOR_COLS}, ids, nb_vendeurs, keys=VENDOR_COLS)
+    vendeurs['TELEPHONE'] = vendeurs['PVT'].map(get_telephone_by_pvt(df_filtre_pvt))
+
+    faits = pd.DataFrame({VENDOR_KEY: ids})
+    cles = [VENDOR_KEY]
+    if 'ETAT_IDENTIFICATION' in df_filtre_pvt.columns:
+        codes_etat, etats = pd.factorize(df_filtre_pvt['ETAT_IDENTIFICATION'], sort=True)
+        faits['ETAT'] = codes_etat
+        cles.append('ETAT')
+    faits = faits[(faits[cles] >= 0).all(axis=1)]
+
+    comptes = faits.groupby(cles, sort=True).size().reset_index(name='VENTES_TOTALES')
+    df_grouped = vendeurs.take(comptes[VENDOR_KEY].to_numpy()).reset_index(drop=True)
+    if 'ETAT' in comptes.columns:
+        df_grouped['ETAT_IDENTIFICATION'] = etats.take(comptes['ETAT'].to_numpy())
+    df_grouped['VENTES_TOTALES'] = comptes['VENTES_TOTALES'].to_numpy()
+    return df_grouped[get_group_cols(df_grouped) + ['VENTES_TOTALES']]
+
+def merge_counts(partials):
+    """Fusion de comptages partiels (fichiers, jours) au format de `count_sales`.
+
+    Les ventes sont additionnées par vendeur ; le téléphone d'un PVT est le premier
+    non vide des partiels, comme sur la concaténation des fichiers.
+    """
+    partials = [p for p in partials if not p.empty]
+    if not partials:
+        return pd.DataFrame()
+
+    counts = pd.concat(partials, ignore_index=True)
+    telephone = counts.groupby('PVT', sort=False)['TELEPHONE'].first()
+
+    keys = [c for c in get_group_cols(counts) if c != 'TELEPHONE']
+    if 'ETAT_IDENTIFICATION' in keys:
+        counts['ETAT_IDENTIFICATION'] = counts['ETAT_IDENTIFICATION'].fillna('')
+    df_grouped = counts.groupby(keys)['VENTES_TOTALES'].sum().reset_index()
+    df_grouped['TELEPHONE'] = df_grouped['PVT'].map(telephone)
+    return df_grouped[get_group_cols(df_grouped) + ['VENTES_TOTALES']]
+
+def count_sales_file(payload, dr_autorisees=DR_AUTORISEES, etat=ETAT_IDENTIFICATION_RETENU,
+                     prefixes_pvt=PREFIXES_PVT):
+    """Comptages partiels d'un fichier de ventes (exécuté dans un processus du pool)."""
+    df = read_and_normalize_sales(as_file(payload))
+    resultat = {'fichier': payload[0], 'manquantes': get_missing_columns(df), 'lignes_dr': 0,
+                'comptages': pd.DataFrame(), 'periode': sales_period(df)}
+    if resultat['manquantes']:
+        return resultat
+
+    df = filter_dr(df, dr_autorisees)
+    resultat['lignes_dr'] = len(df)
+    df = filter_pvt(filter_etat_identification(df, etat), prefixes_pvt)
+    if len(df):
+        resultat['comptages'] = count_sales(clean_sales(df))
+    return resultat
+
+def rank_sales(df_grouped):
+    # Les comptages peuvent venir du cache des étapes : on ne les modifie pas
+    df_grouped = df_grouped.copy()
+
+    # Codes DR courts
+    df_grouped['DR_COURT'] = df_grouped['DR'].map(DR_MAPPING)
+    df_grouped['DR'] = df_grouped['DR_COURT'].fillna(df_grouped['DR'])
+    df_grouped = df_grouped.drop(columns=['DR_COURT'])
+
+    # Tri et classement
+    df_grouped = df_grouped.sort_values('VENTES_TOTALES', ascending=False)
+    df_grouped['RANG'] = range(1, len(df_grouped) + 1)
+
+    # Organisation des colonnes
+    columns_order = ['RANG', 'PVT', 'LOGIN', 'PRENOM_VENDEUR', 'NOM_VENDEUR', 'DR', 'TELEPHONE']
+    if 'ETAT_IDENTIFICATION' in df_grouped.columns:
+        columns_order.append('ETAT_IDENTIFICATION')
+    columns_order.append('VENTES_TOTALES')
+
+    return df_grouped[columns_order]
+
+def read_and_normalize_sales(uploaded_file):
+    return normalize_sales_columns(read_sales_file(uploaded_file))
+
+def select_sales(df_filtre_etat, prefixes_pvt=PREFIXES_PVT):
+    return clean_sales(filter_pvt(df_filtre_etat, prefixes_pvt))
+
+def sales_schema(df):
+    """Colonnes et types de la lecture, sans les lignes (contrôles de la page à chaque exécution)."""
+    return df.head(0)
+
+def summarize_sales(df_filtre_dr, df_filtre_pvt):
+    """Comptages et nombre de lignes des DR retenues : seul résultat des filtres gardé en session."""
+    return {
+        'lignes_dr': len(df_filtre_dr),
+        'comptages': count_sales(df_filtre_pvt) if len(df_filtre_pvt) else pd.DataFrame(),
+    }
+
+# Étapes du classement : un changement de filtre ne relit pas le fichier (la lecture
+# attend sur disque). Les filtres sont des copies des lignes : recalculés, jamais gardés.
+CLASSEMENT_STAGES = (
+    Stage('lecture', read_and_normalize_sales, params=('uploaded_file',), spill=True),
+    Stage('schéma', sales_schema, deps=('lecture',)),
+    Stage('période', sales_period, deps=('lecture',)),
+    Stage('filtre DR', filter_dr, deps=('lecture',), params=('dr_autorisees',), keep=False),
+    Stage('filtre état', filter_etat_identification, deps=('filtre DR',), params=('etat',), keep=False),
+    Stage('filtre PVT', select_sales, deps=('filtre état',), params=('prefixes_pvt',), keep=False),
+    Stage('comptage', summarize_sales, deps=('filtre DR', 'filtre PVT')),
+)
+
+def generate_excel_classement(df_classement, output, pngs=None, df_evolution=None):
+    # Mise en forme directement dans le writer : pas d'aller-retour par un second buffer
+    with pd.ExcelWriter(output, engine='openpyxl') as writer:
+        df_classement.to_excel(writer, sheet_name='Classement PVT', index=False)
+        style_classement_sheet(writer.sheets['Classement PVT'])
+        if df_evolution is not None:
+            df_evolution.to_excel(writer, sheet_name='Evolution', index=False)
+            ws_evolution = writer.sheets['Evolution']
+            for cell in ws_evolution[1]:
+                cell.font = Font(bold=True, size=11, color="000000")
+            ws_evolution.column_dimensions['A'].width = 30
+            ws_evolution.column_dimensions['B'].width = 15
+            ws_evolution.freeze_panes = 'A2'
+        if pngs:
+            insert_pngs_openpyxl(writer.book, 'Graphiques', pngs)
+    return output
+
+def style_classement_sheet(ws):
+    # Styles
+    header_fill = PatternFill(start_color="D9D9D9", end_color="D9D9D9", fill_type="solid")
+    header_font = Font(bold=True, size=11, color="000000")
+    header_alignment = Alignment(horizontal='center', vertical='center')
+
+    data_font = Font(size=10)
+    data_alignment_left = Alignment(horizontal='left', vertical='center')
+    data_alignment_center = Alignment(horizontal='center', vertical='center')
+
+    total_fill = PatternFill(start_color="FFE5CC", end_color="FFE5CC", fill_type="solid")
+    total_font = Font(bold=True, size=11, color="000000")
+
+    thin_border = Border(
+        left=Side(style='thin', color='000000'),
+        right=Side(style='thin', color='000000'),
+        top=Side(style='thin', color='000000'),
+        bottom=Side(style='thin', color='000000')
+    )
+
+    # Appliquer les styles
+    for cell in ws[1]:
+        cell.fill = header_fill
+        cell.font = header_font
+        cell.alignment = header_alignment
+        cell.border = thin_border
+
+    max_row = ws.max_row
+    max_col = ws.max_column
+
+    for row in ws.iter_rows(min_row=2, max_row=max_row-1, min_col=1, max_col=max_col):
+        for cell in row:
+            cell.border = thin_border
+            cell.font = data_font
+            if cell.column == 1 or cell.column == 9:
+                cell.alignment = data_alignment_center
+            else:
+                cell.alignment = data_alignment_left
+
+    total_row = max_row
+    for cell in ws[total_row]:
+        cell.fill = total_fill
+        cell.font = total_font
+        cell.border = thin_border
+        if cell.column in [1, 9]:
+            cell.alignment = data_alignment_center
+
+    # Largeurs de colonnes
+    ws.column_dimensions['A'].width = 8
+    ws.column_dimensions['B'].width = 30
+    ws.column_dimensions['C'].width = 15
+    ws.column_dimensions['D'].width = 15
+    ws.column_dimensions['E'].width = 15
+    ws.column_dimensions['F'].width = 10
+    ws.column_dimensions['G'].width = 15
+    ws.column_dimensions['H'].width = 18
+    ws.column_dimensions['I'].width = 12
+
+    ws.freeze_panes = 'A2'
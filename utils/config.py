@@ -0,0 +1,8 @@
+"""Emplacements partagés par les modules (données persistantes de l'application)."""
+import os
+
+# Répertoire des données persistantes (état des publications, entrepôt des ventes...)
+DATA_DIR = os.environ.get(
+    "PREACTIVATION_DATA_DIR",
+    os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "data")
+)
@@ -0,0 +1,182 @@
+"""Export du détail des lignes (gros volumes) : CSV.gz, Parquet ou Excel découpé.
+
+Les lignes sont écrites par blocs de `CHUNK_ROWS` dans un `ExportSink` : le
+fichier complet n'est jamais construit en mémoire. En Excel, le détail continue
+sur des feuilles numérotées au-delà de la limite de 1 048 576 lignes, puis sur
+plusieurs classeurs (archive ZIP) au-delà de `MAX_SHEETS_PER_WORKBOOK` feuilles.
+"""
+import gzip
+import io
+
+import pyarrow as pa
+import pyarrow.parquet as pq
+import streamlit as st
+import xlsxwriter
+
+from utils.export import XLSX_MIME, ExportSink, new_export_sink, zip_exports
+
+EXCEL_MAX_ROWS = 1048576         # Limite d'Excel, ligne d'en-tête comprise
+CHUNK_ROWS = 100000              # Lignes écrites par bloc (CSV, Parquet)
+MAX_SHEETS_PER_WORKBOOK = 4      # Au-delà, le détail Excel est réparti sur plusieurs classeurs
+CSV_SEP = ';'
+
+AUCUN = "Aucun"
+FORMATS = {
+    "CSV compressé (.csv.gz)": ("csv.gz", "application/gzip"),
+    "Parquet (.parquet)": ("parquet", "application/vnd.apache.parquet"),
+    "Excel (.xlsx)": ("xlsx", XLSX_MIME),
+}
+
+
+def iter_chunks(df, size=CHUNK_ROWS, columns=None):
+    for start in range(0, len(df), size):
+        chunk = df.iloc[start:start + size]
+        yield chunk if columns is None else chunk[columns]
+
+
+def sheet_title(name, index):
+    """« DETAIL », « DETAIL (2) », « DETAIL (3) »... (31 caractères maximum)."""
+    if index == 0:
+        return name[:31]
+    suffix = f" ({index + 1})"
+    return name[:31 - len(suffix)] + suffix
+
+
+def _head(df, columns=None):
+    """Frame vide avec les colonnes exportées (en-têtes, schéma)."""
+    head = df.head(0)
+    return head if columns is None else head[columns]
+
+
+def write_csv_gz(df, fileobj, columns=None):
+    with gzip.GzipFile(fileobj=fileobj, mode='wb') as gz:
+        text = io.TextIOWrapper(gz, encoding='utf-8', newline='')
+        _head(df, columns).to_csv(text, sep=CSV_SEP, index=False)
+        for chunk in iter_chunks(df, columns=columns):
+            chunk.to_csv(text, sep=CSV_SEP, index=False, header=False)
+        text.flush()
+        # Le flux gzip est fermé par le bloc `with`, pas par le TextIOWrapper
+        text.detach()
+
+
+def _parquet_schema(head):
+    schema = pa.Schema.from_pandas(head, preserve_index=False)
+    # Colonnes texte des extractions (valeurs mêlées nombres / texte) : toujours en chaîne
+    for i, name in enumerate(head.columns):
+        if head[name].dtype == object:
+            schema = schema.set(i, pa.field(str(name), pa.string()))
+    return schema
+
+
+def _as_text(chunk):
+    chunk = chunk.copy()
+    for name in chunk.columns:
+        if chunk[name].dtype == object:
+            col = chunk[name]
+            chunk[name] = col.where(col.isna(), col.astype(str))
+    return chunk
+
+
+def write_parquet(df, fileobj, columns=None):
+    schema = _parquet_schema(_head(df, columns))
+    with pq.ParquetWriter(fileobj, schema) as writer:
+        for chunk in iter_chunks(df, columns=columns):
+            writer.write_table(pa.Table.from_pandas(_as_text(chunk), schema=schema, preserve_index=False))
+
+
+def _excel_rows(chunk):
+    """Lignes d'un bloc en tuples de valeurs Python (cellules vides pour NaN / NaT)."""
+    values = chunk.astype(object)
+    return values.where(chunk.notna(), None).itertuples(index=False, name=None)
+
+
+def write_xlsx(df, fileobj, sheet_name, first_sheet=0, columns=None):
+    """Classeur en mode `constant_memory`, une feuille numérotée par tranche de lignes.
+
+    Ce mode ne garde en mémoire que la ligne en cours : les cellules sont écrites
+    ligne par ligne, dans l'ordre (`to_excel` écrit colonne par colonne, les
+    cellules des lignes déjà vidées sur disque seraient perdues).
+    """
+    rows_per_sheet = EXCEL_MAX_ROWS - 1
+    workbook = xlsxwriter.Workbook(fileobj, {
+        'constant_memory': True,
+        'nan_inf_to_errors': True,
+        'default_date_format': 'yyyy-mm-dd hh:mm:ss',
+    })
+    header_format = workbook.add_format({'bold': True})
+    header = [str(c) for c in _head(df, columns).columns]
+    nb_sheets = max(1, -(-len(df) // rows_per_sheet))
+    for i in range(nb_sheets):
+        worksheet = workbook.add_worksheet(sheet_title(sheet_name, first_sheet + i))
+        worksheet.write_row(0, 0, header, header_format)
+        row = 1
+        part = df.iloc[i * rows_per_sheet:(i + 1) * rows_per_sheet]
+        for chunk in iter_chunks(part, columns=columns):
+            for values in _excel_rows(chunk):
+                worksheet.write_row(row, 0, values)
+                row += 1
+    workbook.close()
+
+
+def export_detail(df, format_label, base_name, session_key, sheet_name='DETAIL', columns=None):
+    """Écrit le détail (colonnes `columns`, toutes par défaut) dans le format choisi ; renvoie l'export."""
+    extension, mime = FORMATS[format_label]
+    if extension == 'csv.gz':
+        export = new_export_sink(session_key, f"{base_name}.csv.gz", mime)
+        write_csv_gz(df, export.handle, columns)
+        return export
+    if extension == 'parquet':
+        export = new_export_sink(session_key, f"{base_name}.parquet", mime)
+        write_parquet(df, export.handle, columns)
+        return export
+
+    rows_per_workbook = (EXCEL_MAX_ROWS - 1) * MAX_SHEETS_PER_WORKBOOK
+    if len(df) <= rows_per_workbook:
+        export = new_export_sink(session_key, f"{base_name}.xlsx", mime)
+        write_xlsx(df, export.handle, sheet_name, columns=columns)
+        return export
+
+    # Trop de lignes pour un classeur : plusieurs fichiers numérotés dans une archive
+    workbooks = []
+    try:
+        for i, part in enumerate(iter_chunks(df, rows_per_workbook)):
+            workbook = ExportSink(f"{base_name}_{i + 1}.xlsx", mime)
+            workbooks.append(workbook)
+            write_xlsx(part, workbook.handle, sheet_name, first_sheet=i * MAX_SHEETS_PER_WORKBOOK, columns=columns)
+        return zip_exports(session_key, f"{base_name}.zip", workbooks)
+    finally:
+        for workbook in workbooks:
+            workbook.close()
+
+
+def choose_detail_format(key, label="📄 Export du détail des lignes"):
+    return st.selectbox(label, [AUCUN, *FORMATS], key=key)
+
+
+class RollingSheet:
+    """Feuille xlsxwriter qui continue sur « NOM (2) », « NOM (3) »... à la limite de lignes d'Excel.
+
+    `setup(worksheet)` est appelé sur chaque nouvelle feuille (en-têtes, largeurs).
+    """
+
+    def __init__(self, workbook, name, setup, max_rows=EXCEL_MAX_ROWS):
+        self.workbook = workbook
+        self.name = name
+        self.setup = setup
+        self.max_rows = max_rows
+        self.sheets = 0
+        self._new_sheet()
+
+    def _new_sheet(self):
+        self.worksheet = self.workbook.add_worksheet(sheet_title(self.name, self.sheets))
+        self.sheets += 1
+        self.setup(self.worksheet)
+        self.row = 1
+
+    def next_row(self):
+        """(feuille, ligne) où écrire la prochaine ligne de données."""
+        if self.row >= self.max_rows:
+            self._new_sheet()
+        row = self.row
+        self.row += 1
+        return self.worksheet, row
@@ -0,0 +1,76 @@
+"""Export des classeurs via un fichier temporaire « spooled ».
+
+Le classeur reste en mémoire tant qu'il est petit et bascule sur disque au-delà
+de `SPOOL_MAX_MO`. Il est lu une seule fois pour le téléchargement, sans les
+copies `BytesIO.getvalue()`, et fermé à la fin de la session.
+"""
+import os
+import shutil
+import tempfile
+import weakref
+import zipfile
+
+import streamlit as st
+
+XLSX_MIME = "application/vnd.openxmlformats-officedocument.spreadsheetml.sheet"
+ZIP_MIME = "application/zip"
+
+# Taille au-delà de laquelle le classeur est écrit sur disque (en Mo)
+SPOOL_MAX_MO = int(os.environ.get("PREACTIVATION_SPOOL_MAX_MB", "16"))
+
+
+class ExportSink:
+    """Destination d'écriture d'un fichier exporté (classeur, archive...)."""
+
+    def __init__(self, file_name, mime=XLSX_MIME):
+        self.file_name = file_name
+        self.mime = mime
+        self._file = tempfile.SpooledTemporaryFile(max_size=SPOOL_MAX_MO * 1024 * 1024, mode="w+b")
+        # Ferme (et supprime) le fichier temporaire quand la session est libérée
+        self._finalizer = weakref.finalize(self, self._file.close)
+
+    @property
+    def handle(self):
+        """Objet fichier binaire à passer à `pd.ExcelWriter`, `wb.save`, `zipfile`..."""
+        return self._file
+
+    def read_all(self):
+        self._file.seek(0)
+        return self._file.read()
+
+    def copy_to(self, fileobj):
+        """Copie le contenu par blocs vers un autre fichier ouvert (disque, membre d'archive...)."""
+        self._file.seek(0)
+        shutil.copyfileobj(self._file, fileobj)
+
+    def download_button(self, label, **kwargs):
+        return st.download_button(
+            label=label,
+            data=self.read_all(),
+            file_name=self.file_name,
+            mime=self.mime,
+            **kwargs
+        )
+
+    def close(self):
+        self._finalizer()
+
+
+def zip_exports(session_key, file_name, exports):
+    """Regroupe plusieurs exports dans une archive ZIP, elle-même écrite dans un export."""
+    archive = new_export_sink(session_key, file_name, ZIP_MIME)
+    with zipfile.ZipFile(archive.handle, "w", compression=zipfile.ZIP_DEFLATED) as zf:
+        for export in exports:
+            with zf.open(export.file_name, "w") as member:
+                export.copy_to(member)
+    return archive
+
+
+def new_export_sink(session_key, file_name, mime=XLSX_MIME):
+    """Crée l'export de la page et ferme celui de l'exécution précédente."""
+    previous = st.session_state.get(session_key)
+    if isinstance(previous, ExportSink):
+        previous.close()
+    sink = ExportSink(file_name, mime)
+    st.session_state[session_key] = sink
+    return sink
@@ -0,0 +1,310 @@
+"""Gouverneur de ressources : contrôle d'admission mémoire des traitements.
+
+Toutes les sessions Streamlit tournent dans le même processus. Chaque
+traitement estime sa mémoire à partir de la taille et du type des fichiers
+déposés, puis attend son tour tant que le budget global est dépassé.
+
+Mise sur disque (`SpilledFrame`) :
+- les grandes tables gardées entre deux exécutions (lecture, détail des lignes :
+  étapes `spill` de utils/pipeline.py) sont toujours sur disque tant que la
+  session est inactive, et relues seulement si une étape en aval est recalculée ;
+- pendant une exécution, `RunTicket.park` ne met sur disque que lorsque le budget
+  est dépassé : le gain se limite alors à une table intermédiaire (ex. les rejets
+  pendant le regroupement des clôtures).
+
+Les résultats gardés en mémoire entre deux exécutions (étapes des pages,
+caches de session `SessionCache`) sont comptés dans le budget, et libérés après
+`INACTIVITE_CACHE_S` secondes sans utilisation.
+"""
+import os
+import shutil
+import tempfile
+import threading
+import time
+import uuid
+import weakref
+from collections import deque
+
+import pandas as pd
+import streamlit as st
+
+# Budget mémoire global partagé par toutes les sessions (en Mo)
+BUDGET_MEMOIRE_MO = int(os.environ.get("PREACTIVATION_MEMORY_BUDGET_MB", "2048"))
+
+# Rapport mémoire / taille du fichier : brut déposé + DataFrame + copies
+FACTEURS_EXPANSION = {
+    ".csv": 6,
+    ".xlsx": 15,
+    ".xlsb": 20,
+}
+FACTEUR_DEFAUT = 10
+
+# Rapport mémoire / taille sur disque des partitions du stock des ventes (pickle)
+FACTEUR_PICKLE = 3
+
+# Caches de session libérés après cette durée d'inactivité (en secondes)
+INACTIVITE_CACHE_S = int(os.environ.get("PREACTIVATION_CACHE_IDLE_SECONDS", "1800"))
+
+# Lignes échantillonnées pour estimer la mémoire des colonnes texte
+ECHANTILLON_MEMOIRE = 1000
+
+
+def estimate_run_memory(uploaded_files):
+    """Estime la mémoire (en octets) d'un traitement à partir des fichiers déposés."""
+    total = 0
+    for f in uploaded_files:
+        if f is None:
+            continue
+        ext = os.path.splitext(f.name)[1].lower()
+        facteur = FACTEURS_EXPANSION.get(ext, FACTEUR_DEFAUT)
+        total += int(f.size) * facteur
+    return total
+
+
+def estimate_value_memory(value):
+    """Mémoire approximative (en octets) d'un résultat : DataFrame, Series ou conteneur de ceux-ci."""
+    if isinstance(value, (pd.DataFrame, pd.Series)):
+        n = len(value)
+        if n <= ECHANTILLON_MEMOIRE:
+            return int(value.memory_usage(deep=True).sum())
+        # Colonnes texte : mesure sur un échantillon, extrapolée au nombre de lignes
+        sample = value.iloc[:ECHANTILLON_MEMOIRE]
+        return int(sample.memory_usage(deep=True).sum() * n / ECHANTILLON_MEMOIRE)
+    if hasattr(value, 'memory_bytes'):
+        return value.memory_bytes()
+    if isinstance(value, dict):
+        return sum(estimate_value_memory(v) for v in value.values())
+    if isinstance(value, (list, tuple)):
+        return sum(estimate_value_memory(v) for v in value)
+    return 0
+
+
+def new_spill_dir():
+    return tempfile.mkdtemp(prefix="preact_spill_")
+
+
+class SpilledFrame:
+    """DataFrame écrit sur disque (pickle) et relu à la demande."""
+
+    def __init__(self, directory, df):
+        self.path = os.path.join(directory, f"{uuid.uuid4().hex}.pkl")
+        df.to_pickle(self.path)
+
+    def load(self):
+        return pd.read_pickle(self.path)
+
+    def discard(self):
+        try:
+            os.remove(self.path)
+        except FileNotFoundError:
+            pass
+
+
+class RunTicket:
+    """Réservation mémoire d'un traitement, avec mise sur disque des DataFrames intermédiaires."""
+
+    def __init__(self, governor, label, estimated_bytes):
+        self.id = uuid.uuid4().hex
+        self.label = label
+        self.estimated_bytes = estimated_bytes
+        self.admitted = False
+        self._governor = governor
+        self._frames = {}
+        self._spill_dir = None
+
+    def park(self, name, df):
+        """Met de côté un DataFrame intermédiaire, sur disque seulement si le budget est dépassé."""
+        if not self._governor.over_budget():
+            self._frames[name] = df
+            return
+        if self._spill_dir is None:
+            self._spill_dir = new_spill_dir()
+        self._frames[name] = SpilledFrame(self._spill_dir, df)
+
+    def fetch(self, name):
+        """Récupère un DataFrame mis de côté (et libère sa copie disque)."""
+        value = self._frames.pop(name)
+        if isinstance(value, SpilledFrame):
+            df = value.load()
+            value.discard()
+            return df
+        return value
+
+    def release(self):
+        self._frames.clear()
+        if self._spill_dir is not None:
+            shutil.rmtree(self._spill_dir, ignore_errors=True)
+            self._spill_dir = None
+        self._governor.release(self)
+
+
+class ResourceGovernor:
+    """File d'attente FIFO qui n'admet les traitements que dans la limite du budget."""
+
+    def __init__(self, budget_bytes):
+        self.budget_bytes = budget_bytes
+        self.in_use = 0
+        self._running = {}
+        # Caches de session : propriétaire -> [octets, dernière utilisation, fonction de libération]
+        self._retained = {}
+        self._queue = deque()
+        self._cond = threading.Condition()
+
+    def _charge(self):
+        return self.in_use + sum(r[0] for r in self._retained.values())
+
+    def over_budget(self):
+        with self._cond:
+            return self._charge() > self.budget_bytes
+
+    def _can_admit(self, ticket):
+        if not self._queue or self._queue[0] is not ticket:
+            return False
+        # Un traitement plus gros que le budget passe seul (avec mise sur disque)
+        if not self._running:
+            return True
+        return self._charge() + ticket.estimated_bytes <= self.budget_bytes
+
+    def retain(self, owner, nbytes, on_evict):
+        """Déclare la mémoire (et les fichiers) gardés en session par `owner` ; `on_evict()` les libère."""
+        with self._cond:
+            self._retained[owner] = [nbytes, time.monotonic(), on_evict]
+            self._cond.notify_all()
+
+    def forget(self, owner):
+        with self._cond:
+            self._retained.pop(owner, None)
+            self._cond.notify_all()
+
+    def evict_idle(self, idle_seconds=INACTIVITE_CACHE_S):
+        """Libère les caches de session inutilisés depuis `idle_seconds`."""
+        now = time.monotonic()
+        with self._cond:
+            idle = [owner for owner, r in self._retained.items() if now - r[1] > idle_seconds]
+            callbacks = [self._retained.pop(owner)[2] for owner in idle]
+            if idle:
+                self._cond.notify_all()
+        for on_evict in callbacks:
+            on_evict()
+
+    def acquire(self, ticket, on_wait=None, poll_seconds=1.0):
+        """Bloque jusqu'à l'admission du ticket. `on_wait(position, en_attente)` est appelé pendant l'attente."""
+        with self._cond:
+            self._queue.append(ticket)
+        try:
+            while True:
+                self.evict_idle()
+                with self._cond:
+                    if self._can_admit(ticket):
+                        self._queue.popleft()
+                        self._running[ticket.id] = ticket
+                        self.in_use += ticket.estimated_bytes
+                        ticket.admitted = True
+                        self._cond.notify_all()
+                        return ticket
+                    position = list(self._queue).index(ticket) + 1
+                    waiting = len(self._queue)
+                if on_wait is not None:
+                    on_wait(position, waiting)
+                with self._cond:
+                    self._cond.wait(poll_seconds)
+        finally:
+            if not ticket.admitted:
+                with self._cond:
+                    if ticket in self._queue:
+                        self._queue.remove(ticket)
+                    self._cond.notify_all()
+
+    def release(self, ticket):
+        with self._cond:
+            if self._running.pop(ticket.id, None) is not None:
+                self.in_use -= ticket.estimated_bytes
+                ticket.admitted = False
+            self._cond.notify_all()
+
+
+_GOVERNOR = ResourceGovernor(BUDGET_MEMOIRE_MO * 1024 * 1024)
+
+
+def get_governor():
+    return _GOVERNOR
+
+
+def _evict(cache_ref):
+    cache = cache_ref()
+    if cache is not None:
+        cache.evict()
+
+
+class SessionCache:
+    """Résultats gardés en session (clé -> valeur), comptés dans le budget du gouverneur.
+
+    Le gouverneur vide le cache d'une session inactive depuis `INACTIVITE_CACHE_S` :
+    la valeur est alors recalculée à la prochaine exécution de la page.
+    """
+
+    def __init__(self):
+        self.id = uuid.uuid4().hex
+        self._entries = {}
+        self._nbytes = 0
+        # Session fermée : sa mémoire n'est plus comptée
+        weakref.finalize(self, get_governor().forget, self.id)
+
+    def __contains__(self, key):
+        return key in self._entries
+
+    def get(self, key, default=None):
+        entries = self._entries
+        if key not in entries:
+            return default
+        # Marque le cache comme utilisé
+        self._account()
+        return entries[key]
+
+    def put(self, entries):
+        """Remplace le contenu du cache par `entries` (dict)."""
+        self._entries = dict(entries)
+        self._nbytes = estimate_value_memory(self._entries)
+        self._account()
+
+    def _account(self):
+        get_governor().retain(self.id, self._nbytes, lambda ref=weakref.ref(self): _evict(ref))
+
+    def evict(self):
+        self._entries = {}
+        self._nbytes = 0
+
+
+def session_cache(session_key):
+    """Cache de la page, conservé dans la session."""
+    cache = st.session_state.get(session_key)
+    if not isinstance(cache, SessionCache):
+        cache = SessionCache()
+        st.session_state[session_key] = cache
+    return cache
+
+
+def admit_uploads(uploaded_files, label):
+    """Réserve la mémoire d'un traitement sur des fichiers déposés."""
+    return admit(estimate_run_memory(uploaded_files), label)
+
+
+def admit(estimated_bytes, label):
+    """Réserve la mémoire d'un traitement Streamlit et affiche la position en file d'attente."""
+    governor = get_governor()
+    ticket = RunTicket(governor, label, estimated_bytes)
+    placeholder = st.empty()
+    started = time.monotonic()
+
+    def on_wait(position, waiting):
+        elapsed = int(time.monotonic() - started)
+        placeholder.info(
+            f"⏳ Serveur occupé : vous êtes en position {position} sur {waiting} dans la file d'attente "
+            f"(mémoire estimée : {ticket.estimated_bytes / 1024 / 1024:.0f} Mo, attente : {elapsed} s)"
+        )
+
+    governor.acquire(ticket, on_wait=on_wait)
+    placeholder.empty()
+    if ticket.estimated_bytes > governor.budget_bytes:
+        st.warning("⚠️ Fichier volumineux : les données intermédiaires seront stockées temporairement sur disque.")
+    return ticket
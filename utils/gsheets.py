@@ -0,0 +1,333 @@
+"""Publication des feuilles d'un reporting vers Google Sheets.
+
+Les feuilles sont découpées en blocs de lignes ; seuls les blocs modifiés
+depuis la dernière publication sont envoyés, regroupés en quelques appels
+`values_batch_update` (limite de cellules par appel, cadence limitée,
+nouvelles tentatives avec backoff sur les erreurs de quota). Les cellules qui
+dépassent de la publication précédente sont effacées par `values_batch_clear`
+(plages seules, sans grille de valeurs vides).
+
+`FakeSheetsBackend` remplace l'API Google en local, pour travailler hors ligne
+(`PREACTIVATION_SHEETS_BACKEND=fake`).
+"""
+import hashlib
+import json
+import os
+import random
+import re
+import threading
+import time
+
+import gspread
+import streamlit as st
+from google.oauth2.service_account import Credentials
+
+from utils.config import DATA_DIR
+
+SCOPES = ["https://www.googleapis.com/auth/spreadsheets"]
+
+CHUNK_ROWS = 500               # Lignes par bloc comparé / envoyé
+MAX_CELLS_PER_REQUEST = 40000  # Cellules maximum par appel batch
+MIN_INTERVAL_S = 1.1           # Environ 60 requêtes par minute
+MAX_RETRIES = 5
+BACKOFF_BASE_S = 2.0
+BACKOFF_MAX_S = 64.0
+
+STATE_PATH = os.path.join(DATA_DIR, "gsheets_state.json")
+_STATE_LOCK = threading.Lock()
+
+
+class RetryableSheetsError(Exception):
+    """Erreur temporaire (quota dépassé, erreur serveur) : l'appel peut être relancé."""
+
+
+def col_letter(index):
+    """0 -> A, 25 -> Z, 26 -> AA."""
+    letters = ""
+    index += 1
+    while index:
+        index, rest = divmod(index - 1, 26)
+        letters = chr(65 + rest) + letters
+    return letters
+
+
+def a1_range(title, row, col, nb_rows, nb_cols):
+    start = f"{col_letter(col)}{row + 1}"
+    end = f"{col_letter(col + nb_cols - 1)}{row + nb_rows}"
+    return "'{}'!{}:{}".format(title.replace("'", "''"), start, end)
+
+
+def _cell(value):
+    if isinstance(value, (bool, int, float, str)):
+        return value
+    return str(value)
+
+
+def frame_to_grid(df):
+    """En-tête + lignes du DataFrame en valeurs JSON (NaN -> vide)."""
+    values = df.astype(object).where(df.notna(), "")
+    grid = [[str(c) for c in df.columns]]
+    grid.extend([_cell(v) for v in row] for row in values.values.tolist())
+    return grid
+
+
+def block_hash(block):
+    return hashlib.sha1(json.dumps(block, ensure_ascii=False, default=str).encode("utf-8")).hexdigest()
+
+
+class GspreadBackend:
+    """Accès réel à l'API Google Sheets via gspread (compte de service)."""
+
+    def __init__(self, credentials_info):
+        credentials = Credentials.from_service_account_info(credentials_info, scopes=SCOPES)
+        self._client = gspread.authorize(credentials)
+        self._spreadsheets = {}
+
+    def _open(self, spreadsheet_key):
+        if spreadsheet_key not in self._spreadsheets:
+            self._spreadsheets[spreadsheet_key] = self._client.open_by_key(spreadsheet_key)
+        return self._spreadsheets[spreadsheet_key]
+
+    def _translate(self, error):
+        status = error.response.status_code
+        if status == 429 or status >= 500:
+            return RetryableSheetsError(str(error))
+        return error
+
+    def ensure_worksheet(self, spreadsheet_key, title, nb_rows, nb_cols):
+        try:
+            spreadsheet = self._open(spreadsheet_key)
+            try:
+                ws = spreadsheet.worksheet(title)
+            except gspread.WorksheetNotFound:
+                spreadsheet.add_worksheet(title, rows=nb_rows, cols=nb_cols)
+                return
+            if ws.row_count < nb_rows or ws.col_count < nb_cols:
+                ws.resize(rows=max(ws.row_count, nb_rows), cols=max(ws.col_count, nb_cols))
+        except gspread.exceptions.APIError as e:
+            raise self._translate(e) from e
+
+    def batch_update(self, spreadsheet_key, data):
+        try:
+            self._open(spreadsheet_key).values_batch_update({"valueInputOption": "RAW", "data": data})
+        except gspread.exceptions.APIError as e:
+            raise self._translate(e) from e
+
+    def batch_clear(self, spreadsheet_key, ranges):
+        try:
+            self._open(spreadsheet_key).values_batch_clear(body={"ranges": ranges})
+        except gspread.exceptions.APIError as e:
+            raise self._translate(e) from e
+
+
+class FakeSheetsBackend:
+    """Classeurs Google Sheets simulés en mémoire (tests et travail hors ligne)."""
+
+    _A1 = re.compile(r"^'(?P<title>(?:[^']|'')+)'!(?P<col>[A-Z]+)(?P<row>\d+):(?P<end_col>[A-Z]+)(?P<end_row>\d+)$")
+
+    def __init__(self, fail_times=0):
+        self.sheets = {}
+        self.calls = []
+        # Nombre d'appels à faire échouer (simulation d'un quota dépassé)
+        self.failures_left = fail_times
+
+    def _maybe_fail(self):
+        if self.failures_left > 0:
+            self.failures_left -= 1
+            raise RetryableSheetsError("429 : quota dépassé (simulé)")
+
+    def ensure_worksheet(self, spreadsheet_key, title, nb_rows, nb_cols):
+        self.calls.append(("ensure_worksheet", spreadsheet_key, title))
+        self._maybe_fail()
+        self.sheets.setdefault((spreadsheet_key, title), {})
+
+    @staticmethod
+    def _col_index(letters):
+        index = 0
+        for ch in letters:
+            index = index * 26 + ord(ch) - 64
+        return index - 1
+
+    def _parse(self, a1):
+        """(titre, première ligne, première colonne, dernière ligne, dernière colonne), indices 0."""
+        m = self._A1.match(a1)
+        return (m.group("title").replace("''", "'"), int(m.group("row")) - 1, self._col_index(m.group("col")),
+                int(m.group("end_row")) - 1, self._col_index(m.group("end_col")))
+
+    def batch_update(self, spreadsheet_key, data):
+        self.calls.append(("batch_update", spreadsheet_key, [d["range"] for d in data]))
+        self._maybe_fail()
+        for d in data:
+            title, row0, col0, _, _ = self._parse(d["range"])
+            cells = self.sheets.setdefault((spreadsheet_key, title), {})
+            for r, row in enumerate(d["values"]):
+                for c, value in enumerate(row):
+                    if value == "":
+                        cells.pop((row0 + r, col0 + c), None)
+                    else:
+                        cells[(row0 + r, col0 + c)] = value
+
+    def batch_clear(self, spreadsheet_key, ranges):
+        self.calls.append(("batch_clear", spreadsheet_key, list(ranges)))
+        self._maybe_fail()
+        for a1 in ranges:
+            title, row0, col0, row1, col1 = self._parse(a1)
+            cells = self.sheets.get((spreadsheet_key, title), {})
+            for key in [k for k in cells if row0 <= k[0] <= row1 and col0 <= k[1] <= col1]:
+                del cells[key]
+
+    def read(self, spreadsheet_key, title):
+        """Contenu d'une feuille sous forme de grille (sans les cellules vides de fin)."""
+        cells = self.sheets.get((spreadsheet_key, title), {})
+        if not cells:
+            return []
+        nb_rows = max(r for r, _ in cells) + 1
+        nb_cols = max(c for _, c in cells) + 1
+        return [[cells.get((r, c), "") for c in range(nb_cols)] for r in range(nb_rows)]
+
+
+class SheetsPublisher:
+    """Publie des DataFrames (titre -> DataFrame) dans un Google Sheet, par différence."""
+
+    def __init__(self, backend, spreadsheet_key, state_path=None, sleep=time.sleep):
+        self.backend = backend
+        self.spreadsheet_key = spreadsheet_key
+        self.state_path = state_path
+        self._sleep = sleep
+        self._memory_state = {}
+        self._last_call = 0.0
+
+    def _load_state(self):
+        if self.state_path is None:
+            return dict(self._memory_state)
+        with _STATE_LOCK:
+            if not os.path.exists(self.state_path):
+                return {}
+            with open(self.state_path, encoding="utf-8") as f:
+                return json.load(f).get(self.spreadsheet_key, {})
+
+    def _save_state(self, state):
+        if self.state_path is None:
+            self._memory_state = state
+            return
+        with _STATE_LOCK:
+            full = {}
+            if os.path.exists(self.state_path):
+                with open(self.state_path, encoding="utf-8") as f:
+                    full = json.load(f)
+            full[self.spreadsheet_key] = state
+            os.makedirs(os.path.dirname(self.state_path), exist_ok=True)
+            tmp_path = self.state_path + ".tmp"
+            with open(tmp_path, "w", encoding="utf-8") as f:
+                json.dump(full, f)
+            os.replace(tmp_path, self.state_path)
+
+    def _call(self, fn, *args):
+        """Appel cadencé, relancé avec backoff exponentiel sur les erreurs temporaires."""
+        for attempt in range(MAX_RETRIES + 1):
+            wait = MIN_INTERVAL_S - (time.monotonic() - self._last_call)
+            if wait > 0:
+                self._sleep(wait)
+            self._last_call = time.monotonic()
+            try:
+                return fn(*args)
+            except RetryableSheetsError:
+                if attempt == MAX_RETRIES:
+                    raise
+                self._sleep(min(BACKOFF_MAX_S, BACKOFF_BASE_S * 2 ** attempt) + random.uniform(0, 1))
+
+    def publish(self, sheets):
+        state = self._load_state()
+        new_state = dict(state)
+        pending, to_clear = [], []
+        stats = {"ranges": 0, "unchanged_blocks": 0, "requests": 0}
+
+        for title, df in sheets.items():
+            grid = frame_to_grid(df)
+            nb_rows, nb_cols = len(grid), len(grid[0])
+            old = state.get(title, {"blocks": [], "rows": 0, "cols": 0})
+
+            if title not in state or old["rows"] < nb_rows or old["cols"] < nb_cols:
+                self._call(self.backend.ensure_worksheet, self.spreadsheet_key, title, nb_rows, nb_cols)
+                stats["requests"] += 1
+
+            hashes = []
+            rows_per_range = max(1, min(CHUNK_ROWS, MAX_CELLS_PER_REQUEST // nb_cols))
+            for i, start in enumerate(range(0, nb_rows, CHUNK_ROWS)):
+                block = grid[start:start + CHUNK_ROWS]
+                h = block_hash(block)
+                hashes.append(h)
+                if i < len(old["blocks"]) and old["blocks"][i] == h and old["cols"] == nb_cols:
+                    stats["unchanged_blocks"] += 1
+                    continue
+                # Bloc large : découpé en plages qui tiennent chacune dans un appel
+                for sub in range(0, len(block), rows_per_range):
+                    rows = block[sub:sub + rows_per_range]
+                    pending.append({"range": a1_range(title, start + sub, 0, len(rows), nb_cols), "values": rows})
+
+            # Effacer ce qui dépasse de la publication précédente (plages sans valeurs)
+            if old["rows"] > nb_rows:
+                to_clear.append(a1_range(title, nb_rows, 0, old["rows"] - nb_rows, max(nb_cols, old["cols"])))
+            if old["cols"] > nb_cols:
+                to_clear.append(a1_range(title, 0, nb_cols, nb_rows, old["cols"] - nb_cols))
+
+            new_state[title] = {"blocks": hashes, "rows": nb_rows, "cols": nb_cols}
+
+        # Regroupement des plages en appels batch bornés en nombre de cellules
+        batch, batch_cells = [], 0
+        for item in pending:
+            cells = len(item["values"]) * len(item["values"][0])
+            if batch and batch_cells + cells > MAX_CELLS_PER_REQUEST:
+                self._call(self.backend.batch_update, self.spreadsheet_key, batch)
+                stats["requests"] += 1
+                batch, batch_cells = [], 0
+            batch.append(item)
+            batch_cells += cells
+        if batch:
+            self._call(self.backend.batch_update, self.spreadsheet_key, batch)
+            stats["requests"] += 1
+        if to_clear:
+            self._call(self.backend.batch_clear, self.spreadsheet_key, to_clear)
+            stats["requests"] += 1
+
+        stats["ranges"] = len(pending) + len(to_clear)
+        self._save_state(new_state)
+        return stats
+
+
+_BACKEND = None
+_PUBLISHERS = {}
+
+
+def get_backend():
+    global _BACKEND
+    if _BACKEND is None:
+        if os.environ.get("PREACTIVATION_SHEETS_BACKEND") == "fake":
+            _BACKEND = FakeSheetsBackend()
+        else:
+            _BACKEND = GspreadBackend(dict(st.secrets["gcp_service_account"]))
+    return _BACKEND
+
+
+def get_publisher(spreadsheet_key):
+    """Un éditeur par Google Sheet : l'état de la dernière publication est conservé."""
+    if spreadsheet_key not in _PUBLISHERS:
+        backend = get_backend()
+        # L'état du backend simulé ne survit pas au processus : on ne le persiste pas non plus
+        state_path = None if isinstance(backend, FakeSheetsBackend) else STATE_PATH
+        _PUBLISHERS[spreadsheet_key] = SheetsPublisher(backend, spreadsheet_key, state_path=state_path)
+    return _PUBLISHERS[spreadsheet_key]
+
+
+def render_publish_panel(sheets, session_key):
+    """Bloc Streamlit de publication des feuilles d'un reporting."""
+    with st.expander("☁️ Publier sur Google Sheets"):
+        spreadsheet_key = st.text_input("Clé du Google Sheet (dans son URL)", key=f"{session_key}_cle")
+        if st.button("Publier", key=f"{session_key}_publier", disabled=not spreadsheet_key):
+            publisher = get_publisher(spreadsheet_key)
+            with st.spinner("⏳ Publication en cours..."):
+                stats = publisher.publish(sheets)
+            st.success(
+                f"✅ Publication terminée : {stats['ranges']} plages envoyées en {stats['requests']} requêtes "
+                f"({stats['unchanged_blocks']} blocs inchangés)"
+            )
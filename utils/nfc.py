@@ -0,0 +1,208 @@
+"""Données NFC : lecture, nettoyage et index pré-agrégé pour l'explorateur.
+
+L'explorateur affiche d'abord la synthèse par DR et ne calcule un niveau
+enfant (SADI, RAVT, PVT, VTO) qu'à l'ouverture du nœud parent.
+"""
+import pandas as pd
+import streamlit as st
+
+from utils.governor import estimate_value_memory, session_cache
+from utils.parallel import as_file
+from utils.vendeurs import vendor_ids, vendor_table
+
+# Mapping officiel des DR
+DR_MAPPING = {
+    'DV-DRVE_DIRECTION REGIONALE DES VENTES EST': 'DRE',
+    'DV-DRVC_DIRECTION REGIONALE DES VENTES CENTRE': 'DRC',
+    'DV-DRVN_DIRECTION REGIONALE DES VENTES NORD': 'DRN',
+    'DV-DRVSE_DIRECTION REGIONALE DES VENTES SUD-EST': 'DRSE',
+    'DV-DRV2_DIRECTION REGIONALE DES VENTES DAKAR 2': 'DR2',
+    'DV-DRV1_DIRECTION REGIONALE DES VENTES DAKAR 1': 'DR1',
+    'DV-DRVS_DIRECTION REGIONALE DES VENTES SUD': 'DRS'
+}
+
+MESURES = ['OPERATION NFC', 'OPERATION MANUELLE', 'TOTAL OPERATION']
+
+# Une ligne par LOGIN et rattachement (la première rencontrée est gardée)
+CLE_LIGNE = ['LOGIN', 'SADI', 'RAVT', 'DR']
+
+# Hiérarchie de l'explorateur : (libellé, colonne)
+NIVEAUX = [
+    ('DR', 'DR'),
+    ('SADI', 'SADI'),
+    ('RAVT', 'RAVT'),
+    ('PVT', 'ACCUEIL'),
+    ('VTO', 'LOGIN'),
+]
+COLONNES_NIVEAUX = [col for _, col in NIVEAUX]
+
+
+def read_reference(ref_file):
+    df_ref = pd.read_csv(ref_file) if ref_file.name.endswith('.csv') else pd.read_excel(ref_file)
+    df_ref.columns = [str(c).strip() for c in df_ref.columns]
+    # On garde une seule ligne par LOGIN pour ne pas multiplier les stats
+    return df_ref[['LOGIN', 'SADI', 'RAVT']].drop_duplicates(subset=['LOGIN'])
+
+
+def read_weekly(weekly_file):
+    if weekly_file.name.endswith('.csv'):
+        df_weekly = pd.read_csv(weekly_file, sep=';')
+    elif weekly_file.name.endswith('.xlsb'):
+        df_weekly = pd.read_excel(weekly_file, engine='pyxlsb')
+    else:
+        df_weekly = pd.read_excel(weekly_file)
+
+    df_weekly.columns = [str(c).strip() for c in df_weekly.columns]
+    return df_weekly
+
+
+def prepare_nfc_rows(df_ref, df_weekly):
+    """Lignes WEEKLY des DR suivies, rattachées au référentiel (SADI, RAVT) et dédoublonnées."""
+    # Filtrage et renommage des DR initial
+    df_weekly = df_weekly[df_weekly['AGENCE'].isin(DR_MAPPING.keys())].copy()
+    df_weekly['DR'] = df_weekly['AGENCE'].map(DR_MAPPING)
+
+    # Jointure INNER pour ne garder que ce qui est mappé (Supprime les "Inconnus")
+    df_final = pd.merge(df_weekly, df_ref, on='LOGIN', how='inner')
+    del df_weekly
+
+    # Nettoyage strict des lignes vides ou sans SADI/RAVT
+    df_final = df_final.dropna(subset=['SADI', 'RAVT'])
+    df_final = df_final[(df_final['SADI'].astype(str).str.strip() != "") &
+                        (df_final['RAVT'].astype(str).str.strip() != "")]
+
+    # CORRECTION : Garder seulement le SADI qui correspond au DR du LOGIN
+    # Cela évite qu'un SADI apparaisse dans plusieurs DR
+    return df_final.drop_duplicates(subset=CLE_LIGNE)
+
+
+def finalize_nfc_rows(df_final):
+    # Nettoyer les valeurs numériques nulles ou invalides
+    df_final = df_final[
+        (df_final['OPERATION NFC'].notna()) &
+        (df_final['OPERATION MANUELLE'].notna()) &
+        (df_final['TOTAL OPERATION'].notna())
+    ]
+    return df_final
+
+
+def prepare_nfc_file(payload, df_ref):
+    """Lignes préparées d'un fichier WEEKLY (exécuté dans un processus du pool)."""
+    return prepare_nfc_rows(df_ref, read_weekly(as_file(payload)))
+
+
+def merge_nfc_parts(parts):
+    """Fusion des fichiers WEEKLY préparés : même résultat que sur les fichiers mis bout à bout."""
+    return finalize_nfc_rows(pd.concat(parts, ignore_index=True).drop_duplicates(subset=CLE_LIGNE))
+
+
+def add_taux(df):
+    df['Taux'] = (df['OPERATION NFC'] / df['TOTAL OPERATION'].where(df['TOTAL OPERATION'] > 0) * 100).fillna(0)
+    return df
+
+
+def table_vendeurs_nfc(df_final):
+    """Dimension vendeurs NFC : LOGIN -> (PRÉNOM, NOM), pour les lignes VTO du classeur."""
+    colonnes = {c: df_final[c] for c in ['LOGIN', 'PRENOM', 'NOM'] if c in df_final.columns}
+    if 'LOGIN' not in colonnes:
+        return {}
+    ids, nb_vendeurs = vendor_ids(df_final, ['LOGIN'])
+    table = vendor_table(colonnes, ids, nb_vendeurs, keys=['LOGIN'])
+    for col in ['PRENOM', 'NOM']:
+        if col not in table.columns:
+            table[col] = ''
+    return dict(zip(table['LOGIN'], zip(table['PRENOM'], table['NOM'])))
+
+
+class NFCExplorer:
+    """Index DR → SADI → RAVT → PVT → VTO agrégé une fois au grain LOGIN."""
+
+    def __init__(self, df_final):
+        self.vendeurs = table_vendeurs_nfc(df_final)
+
+        df = df_final[[c for c in COLONNES_NIVEAUX + MESURES + ['PRENOM', 'NOM'] if c in df_final.columns]].copy()
+        for col in COLONNES_NIVEAUX:
+            df[col] = df[col].fillna('').astype(str)
+        for col in ['PRENOM', 'NOM']:
+            if col not in df.columns:
+                df[col] = ''
+
+        # Sommes sur la clé entière DR/SADI/RAVT/PVT/VTO, libellés et noms joints ensuite
+        ids, nb_noeuds = vendor_ids(df, COLONNES_NIVEAUX)
+        sommes = df[MESURES].groupby(ids, sort=True).sum()
+        noeuds = vendor_table({c: df[c] for c in COLONNES_NIVEAUX + ['PRENOM', 'NOM']}, ids, nb_noeuds,
+                              keys=COLONNES_NIVEAUX)
+        # MultiIndex trié : un nœud se retrouve par recherche dichotomique
+        self._index = pd.concat([noeuds, sommes], axis=1).set_index(COLONNES_NIVEAUX)
+        self._index = self._index[MESURES + ['PRENOM', 'NOM']].sort_index()
+        self._children = {}
+        self._aggregates = {}
+
+    def children(self, path):
+        """Agrégats des enfants du nœud `path` (tuple de valeurs depuis la DR), mémorisés."""
+        path = tuple(path)
+        if path not in self._children:
+            sub = self._index.xs(path, level=list(range(len(path)))) if path else self._index
+            if len(path) == len(NIVEAUX) - 1:
+                # Dernier niveau : une ligne par LOGIN
+                level = sub[['PRENOM', 'NOM'] + MESURES].copy()
+                level.index.name = 'LOGIN'
+            else:
+                level = sub.groupby(level=0, sort=True)[MESURES].sum()
+                level.index.name = NIVEAUX[len(path)][0]
+            self._children[path] = add_taux(level.reset_index())
+        return self._children[path]
+
+
+    def aggregate(self, levels):
+        """Agrégats à un grain donné (ex. ['DR', 'SADI']) calculés depuis l'index, mémorisés."""
+        levels = tuple(levels)
+        if levels not in self._aggregates:
+            agg = self._index.groupby(level=list(levels), sort=True)[MESURES].sum()
+            self._aggregates[levels] = add_taux(agg.reset_index())
+        return self._aggregates[levels]
+
+    def memory_bytes(self):
+        """Mémoire de l'index et des niveaux déjà calculés (compte du gouverneur)."""
+        return estimate_value_memory([self._index, *self._children.values(), *self._aggregates.values()])
+
+
+def get_explorer(session_key, data_key, df_final):
+    """Réutilise l'explorateur de la session tant que les fichiers n'ont pas changé."""
+    cache = session_cache(session_key)
+    explorer = cache.get(data_key)
+    if explorer is None:
+        explorer = NFCExplorer(df_final)
+        cache.put({data_key: explorer})
+    return explorer
+
+
+def render_explorer(explorer, page_size=50):
+    """Affiche la cascade : un niveau n'est calculé que si son parent est sélectionné."""
+    path = []
+    for depth, (label, _) in enumerate(NIVEAUX):
+        level = explorer.children(path)
+        titre = " / ".join(path) if path else "Synthèse DR"
+        st.markdown(f"**{titre}** : {len(level)} {label}")
+
+        # Pagination côté serveur : seule la page demandée est envoyée au navigateur
+        nb_pages = max(1, -(-len(level) // page_size))
+        page = 1
+        if nb_pages > 1:
+            page = st.number_input(
+                f"Page ({nb_pages} pages)", min_value=1, max_value=nb_pages, value=1,
+                key=f"nfc_page_{depth}_{'|'.join(path)}"
+            )
+        debut = (page - 1) * page_size
+        st.dataframe(level.iloc[debut:debut + page_size], use_container_width=True, hide_index=True)
+
+        if depth == len(NIVEAUX) - 1:
+            break
+        choix = st.selectbox(
+            f"Développer un {label}",
+            [''] + level[label].tolist(),
+            key=f"nfc_noeud_{depth}_{'|'.join(path)}"
+        )
+        if not choix:
+            break
+        path.append(choix)
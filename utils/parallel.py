@@ -0,0 +1,87 @@
+"""Lecture parallèle de plusieurs fichiers déposés (pool de processus partagé).
+
+Chaque fichier est lu et réduit dans un processus du pool (comptages partiels,
+lignes utiles) : seul ce résultat revient à la page, qui fusionne les partiels.
+Les fichiers bruts ne sont jamais concaténés.
+"""
+import io
+import multiprocessing
+import os
+import threading
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+
+from utils.governor import session_cache
+
+MAX_WORKERS = int(os.environ.get("PREACTIVATION_PARSE_WORKERS", str(min(4, os.cpu_count() or 1))))
+
+_POOL = None
+_POOL_LOCK = threading.Lock()
+
+
+def get_pool():
+    global _POOL
+    with _POOL_LOCK:
+        if _POOL is None:
+            # « spawn » : pas de fork du serveur Streamlit et de ses threads
+            _POOL = ProcessPoolExecutor(max_workers=MAX_WORKERS, mp_context=multiprocessing.get_context("spawn"))
+        return _POOL
+
+
+def _reset_pool():
+    global _POOL
+    with _POOL_LOCK:
+        if _POOL is not None:
+            _POOL.shutdown(wait=False, cancel_futures=True)
+        _POOL = None
+
+
+def file_payload(uploaded_file):
+    """(nom, contenu) d'un fichier déposé, transmissible à un autre processus."""
+    return uploaded_file.name, uploaded_file.getvalue()
+
+
+def as_file(payload):
+    """Fichier en mémoire (avec son nom) reconstruit dans le processus de lecture."""
+    name, data = payload
+    f = io.BytesIO(data)
+    f.name = name
+    return f
+
+
+def map_files(fn, uploaded_files, *args):
+    """`fn(payload, *args)` pour chaque fichier, en parallèle ; résultats dans l'ordre du dépôt."""
+    if len(uploaded_files) == 1:
+        return [fn(file_payload(uploaded_files[0]), *args)]
+    try:
+        futures = [get_pool().submit(fn, file_payload(f), *args) for f in uploaded_files]
+        return [future.result() for future in futures]
+    except BrokenProcessPool:
+        # Un processus a été tué (mémoire insuffisante...) : le pool est recréé à la prochaine lecture
+        _reset_pool()
+        raise
+
+
+def file_key(uploaded_file):
+    """Identifiant d'un dépôt : un fichier redéposé (même nom, même taille) a un nouvel identifiant."""
+    return uploaded_file.file_id
+
+
+def map_files_cached(session_key, fn, uploaded_files, *args, args_key=None):
+    """Comme `map_files`, en gardant en session le résultat de chaque (fichier, paramètres).
+
+    Ajouter un fichier au dépôt ne relit que ce fichier. Les résultats gardés sont
+    comptés par le gouverneur et libérés si la session reste inactive.
+    `args_key` remplace `args` dans la clé quand ils ne sont pas hachables (DataFrame...).
+    """
+    cache = session_cache(session_key)
+    args_key = args if args_key is None else args_key
+    keys = [(file_key(f), args_key) for f in uploaded_files]
+    results = {key: cache.get(key) for key in keys if key in cache}
+    missing = [f for f, key in zip(uploaded_files, keys) if key not in results]
+    if missing:
+        for f, result in zip(missing, map_files(fn, missing, *args)):
+            results[(file_key(f), args_key)] = result
+    # On ne garde que les fichiers du dépôt courant
+    cache.put(results)
+    return [results[key] for key in keys]
@@ -0,0 +1,47 @@
+"""Contrôles des paramètres des traitements (barre latérale des pages)."""
+import streamlit as st
+
+from utils.classement import DR_AUTORISEES, DR_MAPPING, ETAT_IDENTIFICATION_RETENU, PREFIXES_PVT
+from utils.preactivation import PREFIXES_ACCUEIL, SEUIL_CLOTURE
+
+
+def lire_prefixes(texte):
+    """« BOUTIQUE, PVT » -> ('BOUTIQUE', 'PVT')."""
+    return tuple(p.strip().upper() for p in texte.split(',') if p.strip())
+
+
+def parametres_preactivation(key='preactivation'):
+    st.sidebar.subheader("⚙️ Paramètres Préactivations")
+    seuil = st.sidebar.slider(
+        "Seuil d'intensité de clôture", min_value=0, max_value=100, value=SEUIL_CLOTURE, key=f"{key}_seuil"
+    )
+    prefixes = lire_prefixes(st.sidebar.text_input(
+        "Types d'accueil retenus (préfixes séparés par des virgules)", ", ".join(PREFIXES_ACCUEIL),
+        key=f"{key}_prefixes"
+    ))
+    if not prefixes:
+        st.sidebar.warning("⚠️ Aucun préfixe saisi : préfixes par défaut utilisés")
+        prefixes = PREFIXES_ACCUEIL
+    return {'seuil': seuil, 'prefixes': prefixes}
+
+
+def parametres_classement(key='classement'):
+    st.sidebar.subheader("⚙️ Paramètres Classement")
+    dr_autorisees = st.sidebar.multiselect(
+        "DR retenues", DR_AUTORISEES, default=DR_AUTORISEES,
+        format_func=lambda dr: DR_MAPPING.get(dr, dr), key=f"{key}_dr"
+    )
+    etat = st.sidebar.text_input(
+        "État d'identification retenu (vide : tous)", ETAT_IDENTIFICATION_RETENU, key=f"{key}_etat"
+    ).strip()
+    prefixes_pvt = lire_prefixes(st.sidebar.text_input(
+        "Préfixes des PVT (séparés par des virgules)", ", ".join(PREFIXES_PVT), key=f"{key}_prefixes"
+    )) or PREFIXES_PVT
+    return {'dr_autorisees': tuple(dr_autorisees), 'etat': etat, 'prefixes_pvt': prefixes_pvt}
+
+
+def est_parametrage_par_defaut(parametres):
+    """Vrai si les filtres du classement sont ceux des comptages pré-calculés du stock des ventes."""
+    return (set(parametres['dr_autorisees']) == set(DR_AUTORISEES)
+            and parametres['etat'] == ETAT_IDENTIFICATION_RETENU
+            and parametres['prefixes_pvt'] == PREFIXES_PVT)
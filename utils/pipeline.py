@@ -0,0 +1,199 @@
+"""Petit graphe d'étapes mémorisées pour les traitements des pages.
+
+Chaque étape déclare les étapes dont elle dépend et ses propres paramètres.
+Sa clé est formée de ses paramètres et des clés de ses dépendances : quand un
+paramètre change (seuil, préfixes, DR...), seules les étapes en aval sont
+recalculées, la lecture du fichier et les extractions restent en cache.
+
+Les grandes tables gardées (étapes `spill`) restent sur disque entre deux
+exécutions ; les autres résultats gardés sont comptés dans le budget du
+gouverneur. Tout est libéré quand la session reste inactive (voir
+utils/governor.py).
+"""
+import shutil
+import threading
+import uuid
+import weakref
+from collections import Counter
+from dataclasses import dataclass
+
+import pandas as pd
+import streamlit as st
+
+from utils.governor import SpilledFrame, estimate_value_memory, get_governor, new_spill_dir
+from utils.parallel import file_key
+
+
+@dataclass(frozen=True)
+class Stage:
+    name: str
+    fn: object
+    deps: tuple = ()
+    params: tuple = ()
+    # False : le résultat n'est pas gardé en session (copie intermédiaire des lignes,
+    # ou étape dont l'aval n'a pas de paramètres propres)
+    keep: bool = True
+    # True : l'étape reçoit le ticket du gouverneur de l'exécution (`ticket=`, hors clé)
+    uses_ticket: bool = False
+    # True : résultat (DataFrame) gardé sur disque entre deux exécutions, relu si l'aval est recalculé
+    spill: bool = False
+
+
+def fingerprint(value):
+    """Valeur hachable représentant un paramètre (fichier déposé, liste...)."""
+    if hasattr(value, 'file_id') and hasattr(value, 'read'):
+        return ('fichier', file_key(value))
+    if isinstance(value, (list, tuple, set, frozenset)):
+        items = [fingerprint(v) for v in value]
+        return tuple(sorted(items, key=repr)) if isinstance(value, (set, frozenset)) else tuple(items)
+    return value
+
+
+def _evict(pipeline_ref):
+    pipeline = pipeline_ref()
+    if pipeline is not None:
+        pipeline.evict()
+
+
+class Pipeline:
+    def __init__(self, stages):
+        self.stages = {stage.name: stage for stage in stages}
+        # Nombre d'étapes qui utilisent chaque étape
+        self._consumers = Counter(dep for stage in stages for dep in stage.deps)
+        # Étape -> (clé, (résultat ou SpilledFrame,) ou None, octets estimés en mémoire)
+        self._cache = {}
+        self._spill_dir = None
+        self.last_run = []
+        self._ticket = None
+        self.id = uuid.uuid4().hex
+        self._lock = threading.RLock()
+        # Session fermée : sa mémoire n'est plus comptée
+        weakref.finalize(self, get_governor().forget, self.id)
+
+    def _key(self, name, params, keys):
+        if name not in keys:
+            stage = self.stages[name]
+            keys[name] = (
+                tuple(fingerprint(params[p]) for p in stage.params),
+                tuple(self._key(dep, params, keys) for dep in stage.deps),
+            )
+        return keys[name]
+
+    def _is_cached(self, name, params, keys):
+        cached = self._cache.get(name)
+        return cached is not None and cached[0] == self._key(name, params, keys) and cached[1] is not None
+
+    def _value(self, name, params, keys, values):
+        if name in values:
+            return values[name]
+        stage = self.stages[name]
+        key = self._key(name, params, keys)
+        if self._is_cached(name, params, keys):
+            value = self._cache[name][1][0]
+            if isinstance(value, SpilledFrame):
+                value = value.load()
+        else:
+            inputs = [self._value(dep, params, keys, values) for dep in stage.deps]
+            kwargs = {p: params[p] for p in stage.params}
+            if stage.uses_ticket:
+                kwargs['ticket'] = self._ticket
+            value = stage.fn(*inputs, **kwargs)
+            del inputs
+            self.last_run.append(name)
+            # Étape intermédiaire non gardée à usage unique (ex. la lecture brute) : libérée dès maintenant
+            for dep in stage.deps:
+                if not self.stages[dep].keep and self._consumers[dep] == 1:
+                    values.pop(dep, None)
+            self._store(name, key, value if stage.keep else None)
+        values[name] = value
+        return value
+
+    def _store(self, name, key, value):
+        self._discard(self._cache.pop(name, None))
+        stage = self.stages[name]
+        if not stage.keep:
+            self._cache[name] = (key, None, 0)
+        elif stage.spill and isinstance(value, pd.DataFrame):
+            if self._spill_dir is None:
+                self._spill_dir = new_spill_dir()
+                weakref.finalize(self, shutil.rmtree, self._spill_dir, True)
+            self._cache[name] = (key, (SpilledFrame(self._spill_dir, value),), 0)
+        else:
+            self._cache[name] = (key, (value,), estimate_value_memory(value))
+
+    @staticmethod
+    def _discard(entry):
+        if entry is not None and entry[1] is not None and isinstance(entry[1][0], SpilledFrame):
+            entry[1][0].discard()
+
+    def _drop_all(self):
+        for entry in self._cache.values():
+            self._discard(entry)
+        self._cache.clear()
+
+    def run(self, target, ticket=None, **params):
+        """Résultat de l'étape `target`, en ne recalculant que les étapes dont la clé a changé.
+
+        `ticket` (gouverneur) est transmis aux étapes `uses_ticket` qui s'exécutent.
+        """
+        with self._lock:
+            self._ticket = ticket
+            try:
+                return self._value(target, params, {}, {})
+            finally:
+                self._ticket = None
+                self._account()
+
+    def pending(self, *targets, **params):
+        """Étapes que `run` recalculerait pour obtenir `targets` (sans rien exécuter)."""
+        keys, seen, names = {}, set(), []
+
+        def visit(name):
+            if name in seen:
+                return
+            seen.add(name)
+            if self._is_cached(name, params, keys):
+                return
+            for dep in self.stages[name].deps:
+                visit(dep)
+            names.append(name)
+
+        for target in targets:
+            visit(target)
+        return names
+
+    def retained_bytes(self):
+        return sum(entry[2] for entry in self._cache.values())
+
+    def _account(self):
+        """Déclare au gouverneur la mémoire des résultats gardés (et marque la session active)."""
+        if not any(entry[1] is not None for entry in self._cache.values()):
+            get_governor().forget(self.id)
+            return
+        get_governor().retain(self.id, self.retained_bytes(), lambda ref=weakref.ref(self): _evict(ref))
+
+    def evict(self):
+        """Libération par le gouverneur (session inactive) : sans effet pendant une exécution."""
+        if self._lock.acquire(blocking=False):
+            try:
+                self._drop_all()
+            finally:
+                self._lock.release()
+
+
+def get_pipeline(session_key, stages):
+    """Graphe d'étapes de la page, conservé dans la session."""
+    pipeline = st.session_state.get(session_key)
+    if not isinstance(pipeline, Pipeline) or list(pipeline.stages.values()) != list(stages):
+        pipeline = Pipeline(stages)
+        st.session_state[session_key] = pipeline
+    # Étapes recalculées pendant cette exécution de la page
+    pipeline.last_run = []
+    return pipeline
+
+
+def render_last_run(pipeline):
+    if pipeline.last_run:
+        st.caption(f"🔁 Étapes recalculées : {', '.join(pipeline.last_run)}")
+    else:
+        st.caption("🔁 Résultats en cache : aucune étape recalculée")
@@ -0,0 +1,386 @@
+"""Reporting des préactivations : filtrage, séparation clôtures / rejets et classeur Excel."""
+import pandas as pd
+import streamlit as st
+
+from utils.charts import insert_pngs_xlsxwriter, split_by_dr, split_figure, static_pngs
+from utils.detail_export import AUCUN, export_detail
+from utils.export import new_export_sink
+from utils.pipeline import Stage
+from utils.vendeurs import VENDOR_KEY, vendor_ids, vendor_table
+
+SEUIL_CLOTURE = 80
+PREFIXES_ACCUEIL = ('BOUTIQUE', 'PVT')
+
+# Renommage des DR selon les spécifications
+DR_MAPPING = {
+    'DV-DRVE_DIRECTION REGIONALE DES VENTES EST': 'DRE',
+    'DV-DRVC_DIRECTION REGIONALE DES VENTES CENTRE': 'DRC',
+    'DV-DRVN_DIRECTION REGIONALE DES VENTES NORD': 'DRN',
+    'DV-DRVSE_DIRECTION REGIONALE DES VENTES SUD-EST': 'DRSE',
+    'DV-DRV2_DIRECTION REGIONALE DES VENTES DAKAR 2': 'DR2',
+    'DV-DRV1_DIRECTION REGIONALE DES VENTES DAKAR 1': 'DR1'
+}
+
+
+def read_sales_extract(uploaded_file):
+    """Lit la feuille de détail (index 1, sinon 0) de l'extraction des ventes."""
+    if uploaded_file.name.endswith('.csv'):
+        df = pd.read_csv(uploaded_file, sep=None, engine='python', encoding='utf-8')
+    else:
+        engine = 'pyxlsb' if uploaded_file.name.endswith('.xlsb') else None
+
+        # Tentative de lecture de la feuille de détail (index 1)
+        try:
+            df = pd.read_excel(uploaded_file, engine=engine, sheet_name=1)
+        except:
+            df = pd.read_excel(uploaded_file, engine=engine, sheet_name=0)
+
+    df.columns = [str(c).strip() for c in df.columns]
+    return df
+
+
+def filtrer_preactivations(df):
+    # Uniquement les "PREACTIVATION"
+    col_filtre = 'preactivateur' if 'preactivateur' in df.columns else 'COMMENTAIRE'
+    if col_filtre in df.columns:
+        df = df[df[col_filtre].astype(str).str.contains('PREACTIVATION', case=False, na=False)]
+
+    # Conversion intensité
+    df = df.copy()
+    df['intensite'] = pd.to_numeric(df['intensite'], errors='coerce').fillna(0)
+    return df
+
+
+def extraire_ravt_accueil(colonne_accueil):
+    """Sépare "ACCUEIL (RAVT)" en deux colonnes RAVT / ACCUEIL, en une passe vectorisée.
+
+    Ce qui est entre parenthèses est le RAVT ; l'accueil est le texte sans les
+    parenthèses. Sans parenthèses, tout le texte est l'accueil et le RAVT est vide.
+    """
+    valeurs = colonne_accueil.astype(object)
+    absents = valeurs.isna()
+
+    # Nettoyer les espaces multiples
+    texte = valeurs.astype(str).str.strip().str.replace(r'\s+', ' ', regex=True)
+
+    ravt = texte.str.extract(r'\(([^)]+)\)', expand=False)
+    avec_parentheses = ravt.notna()
+
+    # Retirer les parenthèses et leur contenu pour obtenir l'accueil
+    accueil_sans = (texte.str.replace(r'\(([^)]+)\)', '', regex=True)
+                    .str.replace(r'\s+', ' ', regex=True)
+                    .str.strip()
+                    .str.strip('()'))
+    accueil = accueil_sans.where(avec_parentheses, texte).str.strip()
+    ravt = ravt.fillna('').str.strip()
+
+    resultat = pd.DataFrame({'RAVT': ravt, 'ACCUEIL': accueil}, index=colonne_accueil.index)
+    resultat.loc[absents, ['RAVT', 'ACCUEIL']] = ''
+    return resultat
+
+
+def ajouter_ravt_accueil(df):
+    """Étape partagée : extraction RAVT / ACCUEIL une seule fois pour toutes les lignes."""
+    if 'ACCUEIL_VENDEUR' in df.columns:
+        df[['RAVT', 'ACCUEIL']] = extraire_ravt_accueil(df['ACCUEIL_VENDEUR'])
+    return df
+
+
+def separer_clotures_rejets(df, seuil=SEUIL_CLOTURE):
+    return df[df['intensite'] >= seuil].copy(), df[df['intensite'] < seuil].copy()
+
+
+def filtrer_par_type_accueil(df_source, prefixes=PREFIXES_ACCUEIL):
+    """Garde les lignes dont l'ACCUEIL (déjà extrait) commence par un des préfixes (BOUTIQUE, PVT)."""
+    if df_source.empty or 'ACCUEIL_VENDEUR' not in df_source.columns:
+        return df_source
+
+    masque = df_source['ACCUEIL'].str.upper().str.startswith(tuple(p.upper() for p in prefixes))
+    return df_source[masque].copy()
+
+
+def table_vendeurs_preactivation(df_detail):
+    """Dimension vendeurs des préactivations : LOGIN -> DR, RAVT, ACCUEIL, prénom, nom.
+
+    Construite sur les lignes d'une feuille (clôtures ou rejets), après le seuil
+    et le filtre BOUTIQUE/PVT : premières valeurs non vides des lignes retenues,
+    comme les agrégations 'first' par LOGIN. La clé VENDEUR_ID vient du détail.
+    """
+    ids = df_detail[VENDOR_KEY].to_numpy()
+    nb_vendeurs = int(ids.max()) + 1 if len(ids) else 0
+
+    # RAVT et ACCUEIL déjà extraits par ajouter_ravt_accueil
+    colonnes = {'LOGIN': df_detail['LOGIN_VENDEUR']}
+    if 'DR' in df_detail.columns:
+        colonnes['DR'] = df_detail['DR']
+    elif 'AGENCE_VENDEUR' in df_detail.columns:
+        colonnes['DR'] = df_detail['AGENCE_VENDEUR']
+    if 'ACCUEIL_VENDEUR' in df_detail.columns:
+        colonnes['RAVT'] = df_detail['RAVT']
+        colonnes['ACCUEIL'] = df_detail['ACCUEIL']
+    elif 'AGENCE_VENDEUR' in df_detail.columns:
+        colonnes['ACCUEIL'] = df_detail['AGENCE_VENDEUR']
+    for col in ['PRENOM_VENDEUR', 'NOM_VENDEUR']:
+        if col in df_detail.columns:
+            colonnes[col] = df_detail[col]
+    vendeurs = vendor_table(colonnes, ids, nb_vendeurs, keys=['LOGIN'])
+
+    # Renommage des DR selon les spécifications (sur la table, pas sur les lignes)
+    if 'DR' in vendeurs.columns:
+        vendeurs['DR'] = vendeurs['DR'].replace(DR_MAPPING)
+
+    # S'assurer que les colonnes nécessaires existent
+    for col in ['DR', 'RAVT', 'ACCUEIL', 'PRENOM_VENDEUR', 'NOM_VENDEUR']:
+        if col not in vendeurs.columns:
+            vendeurs[col] = ''
+    return vendeurs
+
+
+def preparer_donnees_avec_regroupement(df_source, type_donnees='clotures'):
+    if df_source.empty:
+        return pd.DataFrame()
+    vendeurs = table_vendeurs_preactivation(df_source)
+
+    # Vérifier les RAVT vides
+    if 'ACCUEIL_VENDEUR' in df_source.columns:
+        ravts_vides = df_source['RAVT'].isna() | (df_source['RAVT'] == '')
+        if ravts_vides.any():
+            st.warning(f"⚠️ Attention : {ravts_vides.sum()} lignes n'ont pas de RAVT (pas de parenthèses)")
+
+    # IMPORTANT : Chaque ligne = 1 préactivation
+    # Regroupement sur la clé entière du vendeur (un LOGIN) pour éviter les répétitions
+    faits = df_source.loc[df_source[VENDOR_KEY] >= 0, [VENDOR_KEY, 'intensite']]
+    df_grouped = faits.groupby(VENDOR_KEY, sort=True)['intensite'].agg(['size', 'mean'])
+
+    # Attributs du vendeur joints au résultat agrégé
+    df_final = vendeurs.loc[df_grouped.index, ['DR', 'RAVT', 'ACCUEIL', 'PRENOM_VENDEUR', 'NOM_VENDEUR', 'LOGIN']].copy()
+    df_final['PREACTIVATIONS'] = df_grouped['size']         # Nombre total de préactivations = nombre de lignes
+    df_final['CRITERE_INTENSITE'] = df_grouped['mean']      # Moyenne de l'intensité
+    df_final = df_final.reset_index(drop=True)
+
+    # Ajouter les colonnes spécifiques selon le type
+    if type_donnees == 'clotures':
+        df_final['STATUT'] = 'clôturé'
+    elif type_donnees == 'rejets':
+        df_final['PREACTIVATION'] = 'PREACTIVATION'
+
+    # Trier par CRITERE_INTENSITE par ordre décroissant
+    df_final = df_final.sort_values('CRITERE_INTENSITE', ascending=False)
+
+    return df_final
+
+
+
+def preparer_detail_preactivations(df):
+    """Lignes PREACTIVATION avec RAVT / ACCUEIL extraits et clé vendeur : le détail exportable."""
+    df = ajouter_ravt_accueil(filtrer_preactivations(df))
+    if 'LOGIN_VENDEUR' not in df.columns:
+        df['LOGIN_VENDEUR'] = ''
+    df[VENDOR_KEY] = vendor_ids(df, ['LOGIN_VENDEUR'])[0]
+    return df
+
+
+def separer_et_filtrer(df_detail, seuil=SEUIL_CLOTURE, prefixes=PREFIXES_ACCUEIL):
+    df_clotures_raw, df_rejets_raw = separer_clotures_rejets(df_detail, seuil)
+    return filtrer_par_type_accueil(df_clotures_raw, prefixes), filtrer_par_type_accueil(df_rejets_raw, prefixes)
+
+
+def regrouper_par_login(separation):
+    df_clotures_raw, df_rejets_raw = separation
+    return (preparer_donnees_avec_regroupement(df_clotures_raw, 'clotures'),
+            preparer_donnees_avec_regroupement(df_rejets_raw, 'rejets'))
+
+
+def exporter_rapport(rapport, integrer_graphiques=False, session_key='export_preactivation'):
+    """Classeur du reporting (avec la répartition par DR si demandée) : (export, feuilles)."""
+    df_clotures_final, df_rejets_final = rapport
+    pngs = None
+    if integrer_graphiques:
+        try:
+            split_dr = split_by_dr(df_clotures_final, df_rejets_final)
+            pngs = static_pngs([(split_figure(split_dr), split_dr, 'split')])
+        except Exception as e:
+            st.warning(f"⚠️ Graphiques non intégrés : {e}")
+
+    export = new_export_sink(session_key, "Reporting_Final_Preactivations.xlsx")
+    feuilles = generate_excel_preactivation(df_clotures_final, df_rejets_final, export.handle, pngs)
+    return export, feuilles
+
+
+def colonnes_detail(df_detail):
+    """Colonnes du détail exporté (sans la clé technique du vendeur)."""
+    return [c for c in df_detail.columns if c != VENDOR_KEY]
+
+
+def exporter_detail(df_detail, format_detail=AUCUN, session_key='export_detail_preactivation'):
+    """(export, nombre de lignes) du détail, ou None sans format choisi."""
+    if format_detail == AUCUN:
+        return None
+    export = export_detail(df_detail, format_detail, "Detail_Preactivations", session_key,
+                           columns=colonnes_detail(df_detail))
+    return export, len(df_detail)
+
+
+def build_preactivation_report_from_detail(df_detail, ticket=None, seuil=SEUIL_CLOTURE, prefixes=PREFIXES_ACCUEIL):
+    """Des lignes PREACTIVATION (`preparer_detail_preactivations`) aux tableaux par LOGIN.
+
+    Avec un `ticket` du gouverneur, les données intermédiaires sont mises de côté
+    (sur disque si le serveur est saturé) pendant la préparation de l'autre feuille.
+    """
+    # Séparation selon le seuil et filtre BOUTIQUE/PVT
+    df_clotures_raw, df_rejets_raw = separer_et_filtrer(df_detail, seuil, prefixes)
+
+    if ticket is None:
+        return regrouper_par_login((df_clotures_raw, df_rejets_raw))
+
+    # Mise de côté des données brutes (sur disque si le serveur est saturé)
+    ticket.park('clotures', df_clotures_raw)
+    ticket.park('rejets', df_rejets_raw)
+    del df_clotures_raw, df_rejets_raw
+
+    df_clotures_final = preparer_donnees_avec_regroupement(ticket.fetch('clotures'), 'clotures')
+    df_rejets_final = preparer_donnees_avec_regroupement(ticket.fetch('rejets'), 'rejets')
+    return df_clotures_final, df_rejets_final
+
+
+# Étapes du reporting : déplacer le seuil ne relance que séparation / regroupement et export
+PREACTIVATION_STAGES = (
+    Stage('lecture', read_sales_extract, params=('uploaded_file',), keep=False),
+    Stage('détail', preparer_detail_preactivations, deps=('lecture',), spill=True),
+    # Séparation et regroupement dans la même étape : les lignes séparées sont mises de côté
+    # par le ticket pendant le regroupement de l'autre feuille
+    Stage('regroupement', build_preactivation_report_from_detail, deps=('détail',), params=('seuil', 'prefixes'), uses_ticket=True),
+    Stage('export', exporter_rapport, deps=('regroupement',), params=('integrer_graphiques',)),
+    Stage('export du détail', exporter_detail, deps=('détail',), params=('format_detail',)),
+)
+
+# Étapes lourdes (lecture, extraction, regroupement, écriture du détail) : admission par le gouverneur
+ETAPES_ADMISES = ('regroupement', 'export du détail')
+
+
+def generate_excel_preactivation(df_clotures_final, df_rejets_final, output, pngs=None):
+    """Écrit le classeur (LOGIN CLOTURES / PREACTIVATIONS) et renvoie les feuilles exportées."""
+    colonnes_export_clotures = ['DR', 'RAVT', 'ACCUEIL', 'PRENOM_VENDEUR', 'NOM_VENDEUR',
+                                'LOGIN', 'PREACTIVATIONS', 'CRITERE_INTENSITE', 'STATUT']
+    colonnes_export_rejets = ['DR', 'RAVT', 'ACCUEIL', 'PRENOM_VENDEUR', 'NOM_VENDEUR',
+                              'LOGIN', 'PREACTIVATIONS', 'CRITERE_INTENSITE', 'PREACTIVATION']
+    feuilles = {}
+    with pd.ExcelWriter(output, engine='xlsxwriter') as writer:
+        workbook = writer.book
+
+        # Format pour l'en-tête (fond bleu, texte blanc, gras)
+        header_format = workbook.add_format({
+            'bold': True,
+            'bg_color': '#4472C4',
+            'font_color': 'white',
+            'align': 'center',
+            'valign': 'vcenter',
+            'border': 1
+        })
+
+        # Format pour les cellules "clôturé" (texte rouge)
+        statut_format = workbook.add_format({
+            'font_color': 'red',
+            'align': 'center',
+            'border': 1
+        })
+
+        # Format pour les cellules normales
+        cell_format = workbook.add_format({
+            'border': 1,
+            'align': 'left',
+            'valign': 'vcenter'
+        })
+
+        # Format pour les nombres
+        number_format = workbook.add_format({
+            'border': 1,
+            'align': 'center',
+            'valign': 'vcenter'
+        })
+
+        # Onglet 1 - LOGIN CLOTURES
+        if not df_clotures_final.empty:
+            df_clotures_export = df_clotures_final[colonnes_export_clotures]
+            df_clotures_export.to_excel(writer, sheet_name='LOGIN CLOTURES', index=False)
+            feuilles['LOGIN CLOTURES'] = df_clotures_export
+
+            worksheet = writer.sheets['LOGIN CLOTURES']
+
+            # Appliquer le format d'en-tête
+            for col_num, value in enumerate(df_clotures_export.columns.values):
+                worksheet.write(0, col_num, value, header_format)
+
+            # Appliquer le format aux données
+            for row_num in range(len(df_clotures_export)):
+                for col_num, col_name in enumerate(df_clotures_export.columns):
+                    value = df_clotures_export.iloc[row_num, col_num]
+
+                    # Format spécial pour la colonne STATUT (rouge)
+                    if col_name == 'STATUT':
+                        worksheet.write(row_num + 1, col_num, value, statut_format)
+                    # Format pour les colonnes numériques
+                    elif col_name in ['PREACTIVATIONS', 'CRITERE_INTENSITE']:
+                        worksheet.write(row_num + 1, col_num, value, number_format)
+                    else:
+                        worksheet.write(row_num + 1, col_num, value, cell_format)
+
+            # Ajuster la largeur des colonnes
+            worksheet.set_column('A:A', 10)  # DR
+            worksheet.set_column('B:B', 15)  # RAVT
+            worksheet.set_column('C:C', 30)  # ACCUEIL
+            worksheet.set_column('D:E', 20)  # PRENOM, NOM
+            worksheet.set_column('F:F', 20)  # LOGIN
+            worksheet.set_column('G:G', 15)  # PREACTIVATIONS
+            worksheet.set_column('H:H', 18)  # CRITERE_INTENSITE
+            worksheet.set_column('I:I', 12)  # STATUT
+
+        # Onglet 2 - PREACTIVATIONS
+        if not df_rejets_final.empty:
+            df_rejets_export = df_rejets_final[colonnes_export_rejets]
+            df_rejets_export.to_excel(writer, sheet_name='PREACTIVATIONS', index=False)
+            feuilles['PREACTIVATIONS'] = df_rejets_export
+
+            # Formatage de la feuille PREACTIVATIONS
+            worksheet2 = writer.sheets['PREACTIVATIONS']
+
+            # Format pour la colonne PREACTIVATION (texte orange)
+            preactivation_format = workbook.add_format({
+                'font_color': '#FF6600',
+                'align': 'center',
+                'border': 1
+            })
+
+            # Appliquer le format d'en-tête
+            for col_num, value in enumerate(df_rejets_export.columns.values):
+                worksheet2.write(0, col_num, value, header_format)
+
+            # Appliquer le format aux données
+            for row_num in range(len(df_rejets_export)):
+                for col_num, col_name in enumerate(df_rejets_export.columns):
+                    value = df_rejets_export.iloc[row_num, col_num]
+
+                    # Format spécial pour la colonne PREACTIVATION (orange)
+                    if col_name == 'PREACTIVATION':
+                        worksheet2.write(row_num + 1, col_num, value, preactivation_format)
+                    # Format pour les colonnes numériques
+                    elif col_name in ['PREACTIVATIONS', 'CRITERE_INTENSITE']:
+                        worksheet2.write(row_num + 1, col_num, value, number_format)
+                    else:
+                        worksheet2.write(row_num + 1, col_num, value, cell_format)
+
+            # Ajuster la largeur des colonnes
+            worksheet2.set_column('A:A', 10)  # DR
+            worksheet2.set_column('B:B', 15)  # RAVT
+            worksheet2.set_column('C:C', 30)  # ACCUEIL
+            worksheet2.set_column('D:E', 20)  # PRENOM, NOM
+            worksheet2.set_column('F:F', 20)  # LOGIN
+            worksheet2.set_column('G:G', 15)  # PREACTIVATIONS
+            worksheet2.set_column('H:H', 18)  # CRITERE_INTENSITE
+            worksheet2.set_column('I:I', 18)  # PREACTIVATION
+
+        # Onglet 3 - GRAPHIQUES (optionnel, rendus PNG en cache)
+        if pngs:
+            insert_pngs_xlsxwriter(writer.book, 'GRAPHIQUES', pngs)
+
+    return feuilles
@@ -0,0 +1,140 @@
+"""Historique des classements PVT et évolutions de rang.
+
+Chaque classement est conservé sous une forme compacte : une ligne par
+PVT/LOGIN (index trié, catégories, entiers 32 bits). La comparaison avec le
+classement précédent est une jointure sur cet index : son coût dépend du
+nombre de vendeurs, pas du volume de ventes historique.
+
+Un classement est repéré par sa période de ventes (premier et dernier jour) et
+par ses filtres (DR, état, préfixes PVT) : il n'est comparé qu'à un classement
+obtenu avec les mêmes filtres, par défaut celui de la période précédente.
+"""
+import json
+import os
+import threading
+import uuid
+from datetime import datetime
+
+import pandas as pd
+
+from utils.config import DATA_DIR
+
+HISTORY_DIR = os.path.join(DATA_DIR, "classements")
+KEYS = ['PVT', 'LOGIN']
+
+_LOCK = threading.Lock()
+
+
+def filter_signature(filtres):
+    """Clé stable des filtres d'un classement (l'ordre des DR et des préfixes n'y compte pas)."""
+    canon = {k: sorted(v) if isinstance(v, (list, tuple, set, frozenset)) else v for k, v in filtres.items()}
+    return json.dumps(canon, sort_keys=True, ensure_ascii=False)
+
+
+def compact_snapshot(df_classement):
+    snapshot = df_classement[KEYS + ['RANG', 'VENTES_TOTALES']].copy()
+    for col in KEYS:
+        snapshot[col] = snapshot[col].astype(str).astype('category')
+    snapshot['RANG'] = snapshot['RANG'].astype('int32')
+    snapshot['VENTES_TOTALES'] = snapshot['VENTES_TOTALES'].astype('int32')
+    # Un vendeur peut apparaître sur plusieurs lignes (états d'identification) : on garde son meilleur rang
+    snapshot = snapshot.groupby(KEYS, observed=True).agg({'RANG': 'min', 'VENTES_TOTALES': 'sum'})
+    return snapshot.sort_index()
+
+
+def compare_rankings(current, previous):
+    """Jointure indexée de deux classements compacts : évolutions, entrées et sorties."""
+    evolution = current.join(previous, how='outer', lsuffix='', rsuffix='_PREC')
+    nouveau = evolution['RANG_PREC'].isna()
+    sorti = evolution['RANG'].isna()
+
+    # Rang gagné = rang précédent - rang actuel (positif si le vendeur monte)
+    evolution['EVOLUTION_RANG'] = (evolution['RANG_PREC'] - evolution['RANG']).astype('Int32')
+    evolution['EVOLUTION_VENTES'] = (
+        evolution['VENTES_TOTALES'].fillna(0) - evolution['VENTES_TOTALES_PREC'].fillna(0)
+    ).astype('int32')
+    evolution['STATUT'] = ''
+    evolution.loc[nouveau, 'STATUT'] = 'NOUVEAU'
+    evolution.loc[sorti, 'STATUT'] = 'SORTI'
+    for col in ['RANG', 'RANG_PREC', 'VENTES_TOTALES', 'VENTES_TOTALES_PREC']:
+        evolution[col] = evolution[col].astype('Int32')
+
+    evolution = evolution.reset_index()
+    return evolution.sort_values(['RANG', 'RANG_PREC'], na_position='last', kind='stable')
+
+
+class RankingHistory:
+    def __init__(self, root=HISTORY_DIR):
+        self.root = root
+        self._manifest_path = os.path.join(root, "history.json")
+
+    def _load_manifest(self):
+        if not os.path.exists(self._manifest_path):
+            return []
+        with open(self._manifest_path, encoding="utf-8") as f:
+            return json.load(f)
+
+    def _save_manifest(self, manifest):
+        os.makedirs(self.root, exist_ok=True)
+        tmp_path = self._manifest_path + ".tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump(manifest, f, ensure_ascii=False, indent=1)
+        os.replace(tmp_path, self._manifest_path)
+
+    def load(self, entry):
+        return pd.read_pickle(os.path.join(self.root, entry['file']))
+
+    def snapshots(self, filters):
+        """Classements enregistrés avec ces filtres, de la période la plus récente à la plus ancienne."""
+        with _LOCK:
+            manifest = self._load_manifest()
+        entries = [e for e in manifest if e.get('filters') == filters]
+        return sorted(entries, key=lambda e: (e['end'], e['start'], e['created']), reverse=True)
+
+    @staticmethod
+    def preceding(entries, period):
+        """Classement de la période précédente : le plus récent terminé avant le début de `period`."""
+        start = period[0].isoformat()
+        return next((e for e in entries if e['end'] < start), None)
+
+    def record(self, df_classement, label, period, filters):
+        """Enregistre le classement ; celui de la même période avec les mêmes filtres est remplacé."""
+        snapshot = compact_snapshot(df_classement)
+        entry = {
+            'label': label,
+            'start': period[0].isoformat(),
+            'end': period[1].isoformat(),
+            'filters': filters,
+            'file': f"classement-{uuid.uuid4().hex}.pkl",
+            'created': datetime.now().isoformat(timespec='seconds'),
+            'sellers': int(len(snapshot)),
+        }
+        identity = (entry['start'], entry['end'], filters)
+        with _LOCK:
+            os.makedirs(self.root, exist_ok=True)
+            snapshot.to_pickle(os.path.join(self.root, entry['file']))
+            manifest = self._load_manifest()
+            for old in [e for e in manifest if (e.get('start'), e.get('end'), e.get('filters')) == identity]:
+                manifest.remove(old)
+                try:
+                    os.remove(os.path.join(self.root, old['file']))
+                except FileNotFoundError:
+                    pass
+            manifest.append(entry)
+            self._save_manifest(manifest)
+        return snapshot
+
+    def record_and_compare(self, df_classement, label, period, filters, reference):
+        """Enregistre le classement et le compare à `reference` (entrée de `snapshots`, ou None).
+
+        Renvoie l'évolution, ou None sans référence.
+        """
+        current = self.record(df_classement, label, period, filters)
+        if reference is None:
+            return None
+        try:
+            previous = self.load(reference)
+        except FileNotFoundError:
+            # Référence remplacée entre-temps (même période ré-enregistrée par une autre session)
+            return None
+        return compare_rankings(current, previous)
@@ -0,0 +1,63 @@
+"""Rapports combinés : Préactivations et Classement PVT à partir d'une seule lecture.
+
+Les deux rapports partagent l'étape de lecture (gardée sur disque) ; le détail
+des préactivations l'est aussi. Un changement de paramètre, de format ou de
+rapport ne relit donc pas le fichier : seules les étapes en aval sont refaites.
+"""
+from datetime import datetime
+from functools import partial
+
+from utils.classement import (
+    extract_sales_columns,
+    filter_dr,
+    filter_etat_identification,
+    generate_excel_classement,
+    rank_sales,
+    sales_schema,
+    select_sales,
+    summarize_sales,
+)
+from utils.export import new_export_sink
+from utils.pipeline import Stage
+from utils.preactivation import (
+    build_preactivation_report_from_detail,
+    exporter_detail,
+    exporter_rapport,
+    preparer_detail_preactivations,
+    read_sales_extract,
+)
+
+
+def exporter_classement(comptage):
+    """(classement, export) des comptages, ou None si aucun PVT n'est retenu."""
+    if comptage['comptages'].empty:
+        return None
+    df_classement = rank_sales(comptage['comptages'])
+    export = new_export_sink('export_combine_classement',
+                             f"Classement_PVT{datetime.now().strftime('%Y%m%d_%H%M')}.xlsx")
+    generate_excel_classement(df_classement, export.handle)
+    return df_classement, export
+
+
+RAPPORTS_COMBINES_STAGES = (
+    Stage('lecture', read_sales_extract, params=('uploaded_file',), spill=True),
+    # Préactivations
+    Stage('détail', preparer_detail_preactivations, deps=('lecture',), spill=True),
+    Stage('regroupement', build_preactivation_report_from_detail, deps=('détail',), params=('seuil', 'prefixes'), uses_ticket=True),
+    Stage('export', partial(exporter_rapport, session_key='export_combine_preactivation'), deps=('regroupement',)),
+    Stage('export du détail', partial(exporter_detail, session_key='export_combine_detail'), deps=('détail',), params=('format_detail',)),
+    # Classement PVT : colonnes du classement prises dans la lecture partagée
+    Stage('ventes', extract_sales_columns, deps=('lecture',), keep=False),
+    Stage('schéma', sales_schema, deps=('ventes',)),
+    Stage('filtre DR', filter_dr, deps=('ventes',), params=('dr_autorisees',), keep=False),
+    Stage('filtre état', filter_etat_identification, deps=('filtre DR',), params=('etat',), keep=False),
+    Stage('filtre PVT', select_sales, deps=('filtre état',), params=('prefixes_pvt',), keep=False),
+    Stage('comptage', summarize_sales, deps=('filtre DR', 'filtre PVT')),
+    Stage('classement', exporter_classement, deps=('comptage',)),
+)
+
+# Étapes lourdes de chaque rapport : admission par le gouverneur
+ETAPES_ADMISES = {
+    "🚀 Préactivations": ('regroupement', 'export du détail'),
+    "📊 Classement PVT": ('schéma', 'classement'),
+}
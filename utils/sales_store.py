@@ -0,0 +1,130 @@
+"""Stock local des ventes, partitionné par date de vente.
+
+Chaque jour ingéré est un répertoire `date=AAAA-MM-JJ` contenant les lignes de
+ventes (`rows.pkl`) et leurs comptages pré-calculés par vendeur (`counts.pkl`).
+Un classement sur une période ne lit que les comptages des jours demandés.
+Ré-ingérer un jour remplace sa partition (les extractions couvrent des jours complets).
+"""
+import os
+import re
+from datetime import date, datetime
+
+import pandas as pd
+
+from utils.classement import (
+    DR_AUTORISEES,
+    ETAT_IDENTIFICATION_RETENU,
+    PREFIXES_PVT,
+    clean_sales,
+    count_sales,
+    filter_dr,
+    filter_etat_identification,
+    filter_pvt,
+    get_group_cols,
+    merge_counts,
+    parse_sale_dates,
+)
+from utils.config import DATA_DIR
+from utils.governor import FACTEUR_PICKLE
+
+STORE_DIR = os.path.join(DATA_DIR, "ventes")
+
+STORE_COLUMNS = ['DR', 'PVT', 'LOGIN', 'PRENOM_VENDEUR', 'NOM_VENDEUR', 'MSISDN', 'ETAT_IDENTIFICATION']
+
+_PARTITION = re.compile(r"^date=(\d{4}-\d{2}-\d{2})$")
+
+
+def select_stored_sales(rows, dr_autorisees=DR_AUTORISEES, etat=ETAT_IDENTIFICATION_RETENU,
+                        prefixes_pvt=PREFIXES_PVT):
+    """Lignes du stock retenues par les filtres du classement (DR, état, préfixe PVT)."""
+    return filter_pvt(filter_etat_identification(filter_dr(rows, dr_autorisees), etat), prefixes_pvt)
+
+
+def count_daily_sales(rows, **filtres):
+    """Comptages avec les filtres du classement (ceux par défaut pour les comptages du stock)."""
+    df = select_stored_sales(rows, **filtres)
+    if df.empty:
+        return pd.DataFrame(columns=get_group_cols(rows) + ['VENTES_TOTALES'])
+    return count_sales(clean_sales(df))
+
+
+def _write_pickle(df, path):
+    tmp_path = path + ".tmp"
+    df.to_pickle(tmp_path)
+    os.replace(tmp_path, path)
+
+
+class SalesStore:
+    def __init__(self, root=STORE_DIR):
+        self.root = root
+
+    def _partition_dir(self, day):
+        return os.path.join(self.root, f"date={day:%Y-%m-%d}")
+
+    def available_dates(self):
+        if not os.path.isdir(self.root):
+            return []
+        days = []
+        for name in os.listdir(self.root):
+            m = _PARTITION.match(name)
+            if m and os.path.exists(os.path.join(self.root, name, "counts.pkl")):
+                days.append(datetime.strptime(m.group(1), "%Y-%m-%d").date())
+        return sorted(days)
+
+    def ingest(self, df, date_col):
+        """Range les lignes (colonnes normalisées du classement) par jour de vente."""
+        dates = parse_sale_dates(df[date_col])
+        rows = df[[c for c in STORE_COLUMNS if c in df.columns]].copy()
+        rows['DATE_VENTE'] = dates
+        rows = rows[dates.notna()]
+
+        ingested = []
+        for day, day_rows in rows.groupby('DATE_VENTE', sort=True):
+            day = day.date()
+            day_rows = day_rows.drop(columns=['DATE_VENTE']).reset_index(drop=True)
+            partition = self._partition_dir(day)
+            os.makedirs(partition, exist_ok=True)
+            _write_pickle(day_rows, os.path.join(partition, "rows.pkl"))
+            _write_pickle(count_daily_sales(day_rows), os.path.join(partition, "counts.pkl"))
+            ingested.append(day)
+        return ingested
+
+    def _days_between(self, start, end):
+        return [d for d in self.available_dates() if start <= d <= end]
+
+    def stored_days(self, start, end):
+        """Jours déjà stockés entre `start` et `end` (remplacés si on ingère à nouveau ces jours)."""
+        return self._days_between(start, end)
+
+    def estimate_memory(self, start, end, rows=True):
+        """Mémoire (en octets) des lignes (ou des seuls comptages) de la période, d'après les partitions."""
+        name = "rows.pkl" if rows else "counts.pkl"
+        total = 0
+        for d in self._days_between(start, end):
+            try:
+                total += os.path.getsize(os.path.join(self._partition_dir(d), name))
+            except FileNotFoundError:
+                pass
+        return total * FACTEUR_PICKLE
+
+    def load_rows(self, start, end):
+        frames = [pd.read_pickle(os.path.join(self._partition_dir(d), "rows.pkl")).assign(DATE_VENTE=d)
+                  for d in self._days_between(start, end)]
+        return pd.concat(frames, ignore_index=True) if frames else pd.DataFrame(columns=STORE_COLUMNS)
+
+    def load_counts(self, start, end):
+        """Ventes par vendeur sur la période, au format de `count_sales`."""
+        # Jours dans l'ordre : le téléphone d'un PVT est celui du premier jour de la période
+        frames = [pd.read_pickle(os.path.join(self._partition_dir(d), "counts.pkl"))
+                  for d in self._days_between(start, end)]
+        return merge_counts(frames)
+
+
+def default_period(days):
+    """Dernière semaine disponible dans le stock."""
+    if not days:
+        today = date.today()
+        return today, today
+    end = days[-1]
+    start = max(days[0], date.fromordinal(end.toordinal() - 6))
+    return start, end
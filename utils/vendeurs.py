@@ -0,0 +1,72 @@
+"""Dimension vendeurs : une ligne par vendeur, repérée par une clé entière.
+
+`vendor_ids` factorise les colonnes d'identité du vendeur une à une et donne à
+chaque ligne de faits une clé VENDEUR_ID (int32, -1 si une colonne d'identité
+est vide). Les agrégations se font sur cette clé ; les attributs (nom, PVT /
+ACCUEIL, RAVT, DR, téléphone) ne sont joints qu'au résultat agrégé, à partir
+de la table construite par `vendor_table`.
+
+Les clés suivent l'ordre trié des colonnes d'identité : un agrégat sur
+VENDEUR_ID sort dans le même ordre qu'un `groupby` sur ces colonnes.
+"""
+import numpy as np
+import pandas as pd
+
+VENDOR_KEY = 'VENDEUR_ID'
+
+
+def vendor_ids(df, key_cols):
+    """Clé entière de chaque ligne (ordre lexicographique des colonnes) et nombre de vendeurs."""
+    n = len(df)
+    key = np.zeros(n, dtype='int64')
+    valid = np.ones(n, dtype=bool)
+    for col in key_cols:
+        codes, uniques = pd.factorize(df[col], sort=True)
+        valid &= codes >= 0
+        # Combinaison avec les colonnes précédentes, recompressée pour rester petite
+        key, _ = pd.factorize(key * (len(uniques) + 1) + (codes + 1), sort=True)
+
+    ids = np.full(n, -1, dtype='int32')
+    codes, uniques = pd.factorize(key[valid], sort=True)
+    ids[valid] = codes
+    return ids, len(uniques)
+
+
+def first_rows(ids, n_vendors, mask=None):
+    """Position de la première ligne de chaque vendeur (-1 s'il n'en a aucune)."""
+    ok = ids >= 0 if mask is None else mask & (ids >= 0)
+    rows = np.flatnonzero(ok)
+    found, first = np.unique(ids[rows], return_index=True)
+    positions = np.full(n_vendors, -1, dtype='int64')
+    positions[found] = rows[first]
+    return positions
+
+
+def take_rows(values, positions):
+    """Valeurs aux positions données, vide là où la position vaut -1."""
+    values = pd.Series(values)
+    present = positions >= 0
+    if present.all():
+        return values.take(positions).to_numpy()
+    return pd.Series(values.take(positions[present]).to_numpy(),
+                     index=np.flatnonzero(present)).reindex(range(len(positions))).to_numpy()
+
+
+def vendor_table(columns, ids, n_vendors, keys=()):
+    """Table des vendeurs indexée par VENDEUR_ID, à partir de colonnes des lignes de faits.
+
+    Chaque attribut prend la première valeur non vide du vendeur (comme
+    l'agrégation 'first') ; les colonnes `keys`, jamais vides pour une clé
+    valide, sont lues directement sur la première ligne du vendeur.
+    """
+    table = pd.DataFrame(index=pd.RangeIndex(n_vendors, name=VENDOR_KEY))
+    premieres = first_rows(ids, n_vendors)
+    for name, values in columns.items():
+        values = pd.Series(values)
+        if name in keys or not values.hasnans:
+            positions = premieres
+        else:
+            positions = first_rows(ids, n_vendors, values.notna().to_numpy())
+        table[name] = take_rows(values, positions)
+    return table
+